@@ -0,0 +1,138 @@
+######################################################################################################
+# Title: barn.py
+# Description:
+# Geometry of the barn read once from barn.csv (Unit;x1;x2;x3;x4;y1;y2;y3;y4).
+# The bounds of every unit are kept as numpy arrays and the same Barn object is shared by
+# initialization.py, functions.py and interface.py, so the file is not read again for each cow.
+######################################################################################################
+
+import os
+import numpy as np
+import pandas as pd
+
+BARN_FILE = "../data/barn.csv"
+
+# Zone codes given by Barn.zones(), the n-th bed (in the order of barn.csv) has the code BED + n
+OUTSIDE = 0
+ALLEY = 1
+FEED = 2
+CUBICLE = 3
+BED = 4
+
+RASTER_CELL = 1 # size (in cm) of the cells of the zone raster
+
+class Barn:
+
+    # Read the units and their corners
+    def __init__(self, filename=BARN_FILE):
+        table = pd.read_csv(filename, skiprows = 0, sep = ';', header=0)
+        table.columns = ['Unit', 'x1', 'x2', 'x3', 'x4', 'y1', 'y2', 'y3','y4']
+        self.filename = filename
+        self.units = list(table['Unit'])
+        self.index = {unit: i for i, unit in enumerate(self.units)}
+        self.table = table.set_index('Unit')
+        self.x = table[['x1', 'x2', 'x3', 'x4']].to_numpy() # corners of each unit
+        self.y = table[['y1', 'y2', 'y3', 'y4']].to_numpy()
+
+        # Rectangle of each unit as used for the areas: x1 to x3 and y1 to y2
+        self.x_min = self.x[:, 0]
+        self.x_max = self.x[:, 2]
+        self.y_min = self.y[:, 0]
+        self.y_max = self.y[:, 1]
+
+        self.beds = self.units_starting('bed')
+        self.zone_names = {OUTSIDE: 'outside', ALLEY: 'alley', FEED: 'feeding', CUBICLE: 'cubicle'}
+        for n, bed in enumerate(self.beds):
+            self.zone_names[BED + n] = bed
+        self.grid = None
+
+    # Rectangle (x1, x2, y1, y2) of a unit
+    def bounds(self, unit):
+        i = self.index[unit]
+        return self.x_min[i], self.x_max[i], self.y_min[i], self.y_max[i]
+
+    # Names of the units starting with a prefix (e.g. "bed")
+    def units_starting(self, prefix):
+        return [unit for unit in self.units if unit.startswith(prefix)]
+
+    # Positions (arrays of x and y) inside any of the given units (their four corners), borders included
+    def inside(self, units, x, y):
+        x = np.asarray(x)
+        y = np.asarray(y)
+        mask = np.zeros(x.shape, dtype=bool)
+        for unit in units:
+            i = self.index[unit]
+            mask |= in_quadrilateral(self.x[i], self.y[i], x, y)
+        return mask
+
+    # Units painted on the raster, in order: on a shared border feed wins over beds and beds over cubicles
+    def painting_order(self):
+        order = [(ALLEY, 'Base')]
+        order += [(CUBICLE, unit) for unit in self.units_starting('cubicle')]
+        order += [(BED + n, bed) for n, bed in enumerate(self.beds)]
+        order += [(FEED, unit) for unit in self.units_starting('feed')]
+        return order
+
+    # Raster of the zone codes over the base, one cell every `cell` cm, built the first time it is needed
+    def raster(self, cell=RASTER_CELL):
+        if self.grid is not None and self.grid[3] == cell:
+            return self.grid
+        base = self.index['Base']
+        x0 = self.x[base].min()
+        y0 = self.y[base].min()
+        nx = int((self.x[base].max() - x0) // cell) + 1
+        ny = int((self.y[base].max() - y0) // cell) + 1
+        grid = np.full((ny, nx), OUTSIDE, dtype=np.int8)
+
+        for code, unit in self.painting_order():
+            i = self.index[unit]
+            ix0 = max(int((self.x[i].min() - x0) // cell), 0) # only the cells around the unit
+            ix1 = min(int(-(-(self.x[i].max() - x0) // cell)), nx - 1)
+            iy0 = max(int((self.y[i].min() - y0) // cell), 0)
+            iy1 = min(int(-(-(self.y[i].max() - y0) // cell)), ny - 1)
+            gx = x0 + np.arange(ix0, ix1 + 1)*cell
+            for r in range(iy0, iy1 + 1, 512): # a block of rows at a time to limit the memory used
+                gy = y0 + np.arange(r, min(r + 512, iy1 + 1))*cell
+                mask = in_quadrilateral(self.x[i], self.y[i], gx[None, :], gy[:, None])
+                block = grid[r:r + len(gy), ix0:ix1 + 1]
+                block[mask] = code
+
+        self.grid = (grid, x0, y0, cell)
+        return self.grid
+
+    # Zone code of each position (arrays of x and y): outside the base, alley, feeding area,
+    # cubicle or bed n, read from the raster (one array lookup per position)
+    def zones(self, x, y, cell=RASTER_CELL):
+        grid, x0, y0, cell = self.raster(cell)
+        x = np.asarray(x)
+        y = np.asarray(y)
+        ix = np.rint((x - x0)/cell).astype(np.int64)
+        iy = np.rint((y - y0)/cell).astype(np.int64)
+        on_grid = (ix >= 0) & (ix < grid.shape[1]) & (iy >= 0) & (iy < grid.shape[0])
+        zone = np.full(len(x), OUTSIDE, dtype=np.int8)
+        zone[on_grid] = grid[iy[on_grid], ix[on_grid]]
+        return zone
+
+# Function to test if positions are inside a convex quadrilateral given by its corners (in order), borders included
+# the position has to be on the same side of the four edges
+def in_quadrilateral(qx, qy, x, y):
+    positive = True
+    negative = True
+    for k in range(4):
+        xa, ya = qx[k], qy[k]
+        xb, yb = qx[(k + 1) % 4], qy[(k + 1) % 4]
+        cross = (xb - xa)*(y - ya) - (yb - ya)*(x - xa)
+        positive = positive & (cross >= 0)
+        negative = negative & (cross <= 0)
+    return positive | negative
+
+barns = {}
+
+# Function to get the barn of a file, read only the first time (a Barn is returned as it is)
+def load_barn(barn=BARN_FILE):
+    if isinstance(barn, Barn):
+        return barn
+    key = os.path.abspath(barn)
+    if key not in barns:
+        barns[key] = Barn(barn)
+    return barns[key]
@@ -0,0 +1,91 @@
+######################################################################################################
+# Title: batch.py
+# Description:
+# Computes the histograms of all the pairs of cows of each side of the barn for a range of days,
+# without the interface (same results as the "Get all histograms" button), e.g. on a server:
+#   python batch.py 2020-10-16 2020-10-20 --from 06:00 --to 17:59 --area feeding --side left
+# The days are computed in parallel, 2 at a time by default as each one holds its data and up to --memory
+# for its cows (or one at a time with --days 1, the next day being read in the background), the figures
+# are only saved (Agg backend, no display).
+######################################################################################################
+
+import matplotlib
+matplotlib.use('Agg')
+
+import os
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+import initialization as init
+import pipeline as pl
+
+DAYS = 2 # number of days computed at the same time by default
+
+# Function to compute the histograms of one day, returns a report of the day (None if there is no file)
+# the dataframe of the day is read if it is not given, the images are only drawn if png is True
+def run_day(date, settings, sides, processes, df=None, png=False):
+    if not os.path.isfile(pl.fa_file(date)):
+        return None
+    if df is None:
+        df = pl.load_day(date)
+    s = pl.Settings(date, **settings)
+    pipeline = pl.Pipeline(s, processes=processes)
+    report = str(pipeline.all_histograms(df, sides=sides)) + " histograms"
+    if png:
+        nb_images, rate = pipeline.render_histograms(sides)
+        report += ", " + str(nb_images) + " images (" + str(round(rate, 1)) + " images/s)"
+    return report
+
+# Function to read the arguments of the command line
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Histograms of the distance between all the pairs of cows of each side of the barn")
+    parser.add_argument("start", type=datetime.date.fromisoformat, help="first day (YYYY-MM-DD)")
+    parser.add_argument("end", type=datetime.date.fromisoformat, nargs='?', help="last day (YYYY-MM-DD), the first day by default")
+    parser.add_argument("--from", dest="t_min", default="00:00", help="starting time (HH:MM), 00:00 by default")
+    parser.add_argument("--to", dest="t_max", default="23:59", help="ending time (HH:MM, included), 23:59 by default")
+    parser.add_argument("--area", default="all", choices=["all", "feeding", "bedding", "cubicle", "alley", "custom"])
+    parser.add_argument("--custom", type=int, nargs=4, metavar=("X1", "X2", "Y1", "Y2"), help="coordinates of the custom area")
+    parser.add_argument("--both", action="store_true", help="both cows have to be in the area")
+    parser.add_argument("--save", action="store_true", help="save the merged data")
+    parser.add_argument("--bins", type=int, default=50, help="number of bars of the histograms, 50 by default")
+    parser.add_argument("--side", default="both", choices=["left", "right", "both"])
+    parser.add_argument("--png", action="store_true", help="also draw the images of the histograms (only the counts are saved otherwise)")
+    parser.add_argument("--memory", type=float, help="memory (in GiB) the cows of a side of a day can use, 2 by default")
+    parser.add_argument("--days", type=int, default=DAYS, help="number of days computed at the same time (each one can use up to --memory), " + str(DAYS) + " by default")
+    args = parser.parse_args(argv)
+    if args.area == "custom" and args.custom is None:
+        parser.error("--area custom needs --custom X1 X2 Y1 Y2")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    end = args.end if args.end is not None else args.start
+    dates = [args.start + datetime.timedelta(days=k) for k in range((end - args.start).days + 1)]
+    settings = {'t_min': datetime.datetime.strptime(args.t_min, '%H:%M').time(),
+                't_max': datetime.datetime.strptime(args.t_max, '%H:%M').time(),
+                'area': args.area, 'custom': args.custom, 'both': args.both, 'save': args.save, 'nb_bar': args.bins,
+                'memory_budget': None if args.memory is None else int(args.memory*1024**3)}
+    sides = ("left", "right") if args.side == "both" else (args.side,)
+
+    # One day at a time: the next day is read while the current one is computed
+    days = max(min(args.days, len(dates)), 1)
+    if days == 1:
+        for date in dates:
+            if not os.path.isfile(pl.fa_file(date)):
+                print(str(date) + ": no file " + pl.fa_file(date))
+        for date, df in init.iter_days(dates[0], dates[-1], load=pl.load_day):
+            print(str(date) + ": " + run_day(date, settings, sides, os.cpu_count(), df, args.png))
+        return
+
+    # Days in parallel, the cows of a day are then prepared in a single process
+    with ProcessPoolExecutor(days) as executor:
+        futures = {date: executor.submit(run_day, date, settings, sides, 1, None, args.png) for date in dates}
+        for date, future in futures.items():
+            report = future.result()
+            if report is None:
+                print(str(date) + ": no file " + pl.fa_file(date))
+            else:
+                print(str(date) + ": " + report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+######################################################################################################
+# Title: cache.py
+# Description:
+# Cache of the cow dataframes (create_cow, custom_area and fill_data) in the columnar binary format.
+# An entry is found from the content of the source file, the tag, the area and the fill settings,
+# so a changed file is never read from the cache. Each entry holds one time window; a larger cached
+# window of the same area or of the whole barn is reused by taking its measured rows in the window
+# and filling them again. The least recently used entries are removed above the disk quota.
+######################################################################################################
+
+import os
+import time
+import json
+import hashlib
+import storage
+import initialization as init
+import parallel as par
+
+CACHE_DIR = "../data/cache"
+CACHE_QUOTA = 2*1024**3 # bytes
+STALE_TMP = 3600 # seconds after which a temporary file (a write that never finished) is removed
+
+fingerprints = {}
+
+# Function to get a hash of the content of a file, computed once for a given size and modification time
+# and saved next to the file (<file>.sha1), so that other processes and later runs do not read the file again
+# when only the binary copy of a csv file is kept (see storage.is_fresh), the binary file is hashed instead
+def fingerprint(file):
+    if not os.path.isfile(file) and storage.is_fresh(file):
+        file = storage.binary_path(file)
+    stat = os.stat(file)
+    key = [os.path.basename(file), stat.st_size, stat.st_mtime_ns]
+    memo = (os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+    if memo in fingerprints:
+        return fingerprints[memo]
+
+    path = str(file) + '.sha1'
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+        if saved['key'] == key:
+            fingerprints[memo] = saved['sha1']
+            return saved['sha1']
+    except (OSError, ValueError, KeyError, TypeError): # no hash saved yet (or an unreadable one)
+        pass
+
+    digest = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(16*1024*1024), b''):
+            digest.update(block)
+    fingerprints[memo] = digest.hexdigest()
+    tmp = path + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(tmp, 'w') as f:
+            json.dump({'key': key, 'sha1': fingerprints[memo]}, f)
+        os.replace(tmp, path) # the hash file only appears once complete
+    except OSError: # read-only data folder, the hash is only kept in this process
+        pass
+    return fingerprints[memo]
+
+# Function to get the settings of fill_data (method, max_gap) the entries depend on
+def fill_settings():
+    return init.FILL_METHOD, init.FILL_MAX_GAP
+
+class CowCache:
+
+    def __init__(self, directory=CACHE_DIR, quota=CACHE_QUOTA):
+        self.directory = directory
+        self.quota = quota
+
+    # Folder of the entries of a cow, named from the hash of everything but the time window
+    # fill is the (method, max_gap) of fill_data, the current settings of initialization.py by default
+    def folder(self, source, cow_id, area, fill=None):
+        fill = fill_settings() if fill is None else fill
+        key = json.dumps([source, int(cow_id), area, fill[0], fill[1]])
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    # Time windows (e_min, e_max, path) cached in a folder
+    def entries(self, folder):
+        if not os.path.isdir(folder):
+            return []
+        windows = []
+        for name in os.listdir(folder):
+            if name.endswith('.cols'):
+                e_min, e_max = name[:-len('.cols')].split('_')
+                windows.append((int(e_min), int(e_max), os.path.join(folder, name)))
+        return windows
+
+    # Entry of the smallest cached window holding [e_min, e_max[, None if there is none
+    def find(self, folder, e_min, e_max):
+        windows = [w for w in self.entries(folder) if w[0] <= e_min and w[1] >= e_max]
+        if len(windows) == 0:
+            return None
+        return min(windows, key=lambda w: w[1] - w[0])
+
+    # Read an entry and mark it as used, None if it has just been evicted (by another process sharing the cache)
+    def read(self, path):
+        try:
+            df_cow = storage.read_table(path).copy() # not kept memory-mapped, the file may be evicted
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return df_cow
+
+    # Function to get a cow from the cache, None if it is not there
+    # custom gives the coordinates (x1, x2, y1, y2) of a custom area, fill the (method, max_gap) of fill_data
+    def get(self, source, cow_id, e_min, e_max, area, custom=None, fill=None):
+        fill = fill_settings() if fill is None else fill
+        folder = self.folder(source, cow_id, area, fill)
+        entry = self.find(folder, e_min, e_max)
+        if entry is not None and entry[:2] == (e_min, e_max):
+            return self.read(entry[2])
+
+        # A larger window of the area or the whole barn: its measured rows in the window are the rows of the cow
+        whole = entry is None and area != 'all'
+        if whole:
+            entry = self.find(self.folder(source, cow_id, 'all', fill), e_min, e_max)
+        if entry is None:
+            return None
+        df_cow = self.read(entry[2])
+        if df_cow is None:
+            return None
+        t = df_cow['rounded_time'].to_numpy()
+        df_cow = df_cow[(df_cow['data_entity'] != 'FA_ADD').to_numpy() & (t >= e_min) & (t < e_max)]
+        if whole:
+            df_cow = init.area_delimitation(df_cow, area)
+            if custom is not None:
+                df_cow = init.custom_area(df_cow, *custom)
+        df_cow.reset_index(drop=True, inplace=True)
+        return init.fill_data(df_cow, area, *fill)
+
+    # Function to store a cow in the cache (evict() keeps the cache in its quota afterwards)
+    def put(self, df_cow, source, cow_id, e_min, e_max, area, fill=None):
+        folder = self.folder(source, cow_id, area, fill)
+        os.makedirs(folder, exist_ok=True)
+        storage.write_table(df_cow, os.path.join(folder, str(e_min) + '_' + str(e_max) + '.cols'))
+
+    # Function to remove the least recently used entries until the cache fits in the quota
+    # temporary files older than STALE_TMP are removed, the other ones (being written) count in the quota
+    def evict(self):
+        files = []
+        writing = 0
+        now = time.time()
+        for root, dirs, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.cols') or name.endswith('.tmp'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError: # evicted by another process
+                        continue
+                    if name.endswith('.cols'):
+                        files.append((stat.st_mtime, stat.st_size, path))
+                    elif now - stat.st_mtime > STALE_TMP:
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                    else:
+                        writing += stat.st_size
+        total = writing + sum(f[1] for f in files)
+        for mtime, size, path in sorted(files):
+            if total <= self.quota:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError: # still open elsewhere
+                pass
+
+    # Function to get the dataframes of several cows, the ones not in the cache are created and stored
+    # returns {tag_id: dataframe of the cow}, see parallel.create_cows for custom, processes and cancel
+    def cows(self, source, cow_ids, data, e_min, e_max, area, custom=None, processes=1, cancel=None):
+        source = fingerprint(source)
+        fill = fill_settings() # read once: the entries are found and filled with the same settings
+        cows = {cow_id: self.get(source, cow_id, e_min, e_max, area, custom, fill) for cow_id in cow_ids}
+        new_cows = [cow_id for cow_id in cow_ids if cows[cow_id] is None]
+        for cow_id, df_cow in par.create_cows(new_cows, data, e_min, e_max, area, custom, processes, *fill, cancel=cancel).items():
+            self.put(df_cow, source, cow_id, e_min, e_max, area, fill)
+            cows[cow_id] = df_cow
+        if len(new_cows):
+            self.evict()
+        return cows
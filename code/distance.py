@@ -9,27 +9,157 @@
 
 import pandas as pd
 import matplotlib.pyplot as plt
+import os
 import numpy as np
 
+# Memory (in bytes) compute_side can use by default (see pipeline.Settings), the cows of a side are split in blocks above it
+MEMORY_BUDGET = 2*1024**3
+FRAME_ROW_BYTES = 168 # memory of one row (one second) of a cow dataframe, its text columns included
+
+BIN_WIDTH = 10 # width (in cm) of the bins of the pair histograms
+CHUNK_VALUES = 2**22 # number of distances computed at once by PairHistograms.add_cube
+
 # Compare 2 cows and return the merged dataframe when the rows match (on rounded time)
 def compare(df_cow1, df_cow2):
     return pd.merge(df_cow1, df_cow2, how="inner", on="rounded_time")
 
+# Positions of a group of cows on a shared time grid: one row per second, one column per cow
+# pos[t, n] holds the (x, y) of the n-th cow at second times[t] and valid[t, n] tells if it is known
+class HerdCube:
+
+    # Build the grid from a dictionary {tag_id: cow dataframe} (rows with a rounded_time, e.g. after fill_data)
+    # with release, each dataframe is taken out of the dictionary once on the grid so that it can be freed
+    def __init__(self, cows, e_min, e_max, release=False):
+        self.tags = list(cows.keys())
+        self.index = {tag: n for n, tag in enumerate(self.tags)}
+        self.times = np.arange(e_min, e_max)
+        self.pos = np.zeros((len(self.times), len(self.tags), 2), dtype=np.float32)
+        self.valid = np.zeros((len(self.times), len(self.tags)), dtype=bool)
+        for n, tag in enumerate(self.tags):
+            df_cow = cows.pop(tag) if release else cows[tag]
+            if df_cow.empty:
+                continue
+            t = df_cow['rounded_time'].to_numpy().astype(np.int64) - e_min
+            keep = (t >= 0) & (t < len(self.times))
+            self.pos[t[keep], n, 0] = df_cow['x'].to_numpy()[keep]
+            self.pos[t[keep], n, 1] = df_cow['y'].to_numpy()[keep]
+            self.valid[t[keep], n] = True
+
+# Counts of the distances between many pairs of cows in bins shared by all the pairs (and all the days)
+# counts[k, b] is the number of seconds the k-th pair spent at a distance within [edges[b], edges[b+1][
+class PairHistograms:
+
+    def __init__(self, pairs, edges):
+        self.pairs = [(int(cow_id1), int(cow_id2)) for cow_id1, cow_id2 in pairs]
+        self.index = {pair: k for k, pair in enumerate(self.pairs)}
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros((len(self.pairs), len(self.edges) - 1), dtype=np.int64)
+
+    # Bin of each distance, -1 out of the edges (the last bin includes its upper edge, as np.histogram)
+    def bins(self, distances):
+        b = np.searchsorted(self.edges, distances, side='right') - 1
+        b[distances == self.edges[-1]] = len(self.edges) - 2
+        b[b >= len(self.edges) - 1] = -1
+        return b
+
+    # Add distances to the counts, k gives the number of the pair of each distance
+    def add(self, k, distances):
+        b = self.bins(distances)
+        keep = b >= 0
+        nb_bins = self.counts.shape[1]
+        self.counts += np.bincount(k[keep]*nb_bins + b[keep], minlength=self.counts.size).reshape(self.counts.shape)
+
+    # Add the distances of pairs of cows of two cubes on the same time grid (cow 1 in cube, cow 2 in other)
+    # all the pairs at once, a chunk of seconds at a time so that the memory does not depend on the window
+    def add_cube(self, cube, other=None, pairs=None, values=CHUNK_VALUES):
+        other = cube if other is None else other
+        pairs = self.pairs if pairs is None else pairs
+        if len(pairs) == 0:
+            return
+        k = np.array([self.index[(int(cow_id1), int(cow_id2))] for cow_id1, cow_id2 in pairs])
+        n1 = np.array([cube.index[cow_id1] for cow_id1, cow_id2 in pairs])
+        n2 = np.array([other.index[cow_id2] for cow_id1, cow_id2 in pairs])
+        step = max(values // len(pairs), 1)
+        for start in range(0, len(cube.times), step):
+            w = slice(start, start + step)
+            both = cube.valid[w][:, n1] & other.valid[w][:, n2]
+            p1 = cube.pos[w][:, n1].astype(np.float64)
+            p2 = other.pos[w][:, n2].astype(np.float64)
+            distances = np.sqrt(((p2 - p1)**2).sum(axis=2))
+            self.add(np.broadcast_to(k, both.shape)[both], distances[both])
+
+    # Histogram of one pair
+    def pair(self, cow_id1, cow_id2):
+        return self.counts[self.index[(int(cow_id1), int(cow_id2))]]
+
+    # Save the counts, the edges and the pairs in a compressed numpy file (.npz)
+    def save(self, path):
+        pairs = np.array(self.pairs, dtype=np.int64).reshape(-1, 2)
+        with open(path + '.tmp', 'wb') as file:
+            np.savez_compressed(file, tag_id_1=pairs[:, 0], tag_id_2=pairs[:, 1], edges=self.edges, counts=self.counts)
+        os.replace(path + '.tmp', path)
+
+# Function to read pair histograms saved by PairHistograms.save
+def load_histograms(path):
+    with np.load(path) as data:
+        histograms = PairHistograms(zip(data['tag_id_1'], data['tag_id_2']), data['edges'])
+        histograms.counts = data['counts']
+    return histograms
+
+# Function to sum pair histograms (e.g. of several days) over all their pairs, they must have the same edges
+def sum_histograms(list_histograms):
+    pairs = list(dict.fromkeys(pair for h in list_histograms for pair in h.pairs)) # all the pairs, in order
+    total = PairHistograms(pairs, list_histograms[0].edges)
+    for h in list_histograms:
+        if not np.array_equal(h.edges, total.edges):
+            raise ValueError("Histograms with different bin edges cannot be summed")
+        total.counts[[total.index[pair] for pair in h.pairs]] += h.counts
+    return total
+
+# Function to get the bin edges shared by the pair histograms: from 0 to the diagonal of the barn
+def distance_edges(barn, width=BIN_WIDTH):
+    base = barn.index['Base']
+    diagonal = np.hypot(np.ptp(barn.x[base]), np.ptp(barn.y[base]))
+    return np.arange(0, diagonal + width, width, dtype=np.float64)
+
+# Memory (in bytes) of one cow over the given seconds: its cube and, with frame, its dataframe (one row per second at most)
+def cow_bytes(seconds, frame=True):
+    size = seconds*(2*np.dtype(np.float32).itemsize + 1) # positions and validity
+    if frame:
+        size += seconds*FRAME_ROW_BYTES
+    return size
+
+# Number of cows per block so that two blocks of cows (dataframes and cubes) fit in the memory budget
+def cows_per_block(seconds, budget=None):
+    budget = MEMORY_BUDGET if budget is None else budget
+    return max(int(budget // (2*cow_bytes(seconds))), 1)
+
+# Number of blocks of `size` cows that can be kept at once (their cubes, and their dataframes with frames)
+# besides the block being built, at least one
+def blocks_kept(seconds, size, frames, budget=None):
+    budget = MEMORY_BUDGET if budget is None else budget
+    free = budget - size*cow_bytes(seconds)
+    return max(int(free // (size*cow_bytes(seconds, frames))), 1)
+
 # Get the distance between two cows for each row
 def compute_distance(df):
     df['distance'] = ((df['x_y'] - df['x_x'])**2 + (df['y_y'] - df['y_x'])**2).apply(np.sqrt)
     return df
 
+# Draw the histogram of the distances of a merged dataframe on an axis
+def draw_histogram(ax,df,nb_bar,t_min,t_max):
+    ax.hist(df['distance'].dropna().to_numpy(),bins=nb_bar)
+    ax.grid(True)
+    c1 = str(df['tag_id_x'].iloc[0])
+    c2 = str(df['tag_id_y'].iloc[0])
+    title = "Distance " + c1 + " and " + c2 + " between " + t_min.strftime("%H:%M") + " and " + t_max.strftime("%H:%M")
+    ax.set_title(title)
+    ax.set_xlabel("Distance (in cm)")
+
 def histogram(df,show,path,nb_bar,t_min,t_max):
     if df.empty is False:
-        df.hist(column='distance',bins=nb_bar)
-        c1 = str(df['tag_id_x'].loc[0])
-        c2 = str(df['tag_id_y'].loc[0])
-        title = "Distance " + c1 + " and " + c2 + " between " + t_min.strftime("%H:%M") + " and " + t_max.strftime("%H:%M")
-        plt.title(title)
-        plt.xlabel("Distance (in cm)")
         if show == 1:
+            fig, ax = plt.subplots()
+            draw_histogram(ax,df,nb_bar,t_min,t_max)
             plt.show()
-        if show == 0:
-            plt.savefig(path)
-        plt.close()
\ No newline at end of file
+            plt.close(fig)
\ No newline at end of file
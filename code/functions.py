@@ -23,42 +23,30 @@ import matplotlib.patches as pat
 from matplotlib.animation import FuncAnimation
 from matplotlib import transforms
 from datetime import datetime
+import storage
+import store as st
+import parallel as par
+import barn as brn
 
 ###############################################################################
 ####                     READ CSV-FILES                                   #####
 ###############################################################################
  
 def csv_read_FA(filename, nrows):
-    if nrows == 0:
-        df = pd.read_csv(filename, header=None)
-    else:
-        df = pd.read_csv(filename, nrows=nrows, header=None)
-    df.columns = ['data_entity', 'tag_id', 'tag_string', 'time', 'x', 'y', 'z']
+    df = storage.read_csv(filename, ['data_entity', 'tag_id', 'tag_string', 'time', 'x', 'y', 'z'], nrows)
     return df
 
 def csv_read_PA(filename, nrows):
-    if nrows == 0:
-        df = pd.read_csv(filename, header=None)
-    else:
-        df = pd.read_csv(filename, nrows=nrows, header=None)
-    df.columns = ['data_entity', 'tag_id', 'tag_string', 'start', 'end', 'x', 'y', 'z', 'activity_type', 'distance']
+    df = storage.read_csv(filename, ['data_entity', 'tag_id', 'tag_string', 'start', 'end', 'x', 'y', 'z', 'activity_type', 'distance'], nrows)
     return df
 
 def csv_read_PAA(filename, nrows):
-    if nrows == 0:
-        df = pd.read_csv(filename, header=None)
-    else:
-        df = pd.read_csv(filename, nrows=nrows, header=None)
-    df.columns = ['data_entity', 'tag_id', 'tag_string', 'span', 'interval', 'activity_type', 'distance', 'periods',
-                  'duration']
+    df = storage.read_csv(filename, ['data_entity', 'tag_id', 'tag_string', 'span', 'interval', 'activity_type', 'distance', 'periods',
+                  'duration'], nrows)
     return df
 
 def csv_read_PC(filename, nrows):
-    if nrows == 0:
-        df = pd.read_csv(filename, header=None)
-    else:
-        df = pd.read_csv(filename, nrows=nrows, header=None)
-    df.columns = ['data_entity', 'tag_id', 'tag_string', 'start', 'end', 'x', 'y', 'z']
+    df = storage.read_csv(filename, ['data_entity', 'tag_id', 'tag_string', 'start', 'end', 'x', 'y', 'z'], nrows)
     return df
 
 ###############################################################################
@@ -73,96 +61,59 @@ def unique_cows(df):
 def drop_tags(df, tags_filename):
     tags = pd.read_csv(tags_filename, skiprows = 0, sep = ';', header=0)
     tags.columns = ['position', 'Zx', 'Zy', 'tag_string', 'tag_id']
-    tag_ids = list(tags['tag_id'])
-    for i in range(len(tag_ids)):
-        df = df.drop(df[df.tag_id == tag_ids[i]].index)
-    return df
+    return remove_tags(df, tags['tag_id'])
 
-# function to remove ceratin tags in the dataframe
+# function to remove ceratin tags in the dataframe (one mask for all the tags)
 def remove_tags(df, tags):
-    for c in tags:
-        df = df[df.tag_id != c]
-    return df
+    return df[~df['tag_id'].isin(list(tags))]
+
+# function to get statistics of each tag with one grouped reduction: number of rows and range of x and y
+def tag_stats(df):
+    stats = df.groupby('tag_id', sort=False).agg(rows=('y', 'size'), x_min=('x', 'min'), x_max=('x', 'max'),
+                                                 y_min=('y', 'min'), y_max=('y', 'max'))
+    stats['x_range'] = stats['x_max'] - stats['x_min']
+    stats['y_range'] = stats['y_max'] - stats['y_min']
+    return stats
+
+# function to get the ids of the cows on the left and on the right (mean x of each tag with one grouped reduction)
+def side_tags(df, barn_filename):
+    barn = brn.load_barn(barn_filename) # a file name or a Barn
+    left_wall = barn.x_min[0]
+    right_wall = barn.x_max[0]
+    if isinstance(df, st.PositionStore):
+        df = df.df
+    mean_x = df.groupby('tag_id', sort=False)['x'].mean()
+    is_left = mean_x <= left_wall + (right_wall+left_wall)/2
+    return mean_x.index[is_left].tolist(), mean_x.index[~is_left].tolist()
 
 # function to divide cows into left and right    
 def left_right(df, barn_filename):
-    barn = pd.read_csv(barn_filename, skiprows = 0, sep = ';', header=0)
-    barn.columns = ['Unit', 'x1', 'x2', 'x3', 'x4', 'y1', 'y2', 'y3','y4']
-    left_wall = list(barn['x1'])[0]
-    right_wall = list(barn['x3'])[0]
-    u_cows = unique_cows(df)
-    right = []
-    left = []
-    for i in range(len(u_cows)):
-        temp = df.loc[df['tag_id'] == u_cows[i]]
-        x,y,z = positions(temp)
-        if sum(x)/len(x) <= left_wall + (right_wall+left_wall)/2:
-            left.append(u_cows[i])
-            
-        else:
-            right.append(u_cows[i])
-
-    left_df = df[df['tag_id'].isin(left)]
-    right_df = df[df['tag_id'].isin(right)]
+    if isinstance(df, st.PositionStore):
+        df = df.df
+    left, right = side_tags(df, barn_filename)
+    is_left = df['tag_id'].isin(left)
+    left_df = df[is_left]
+    right_df = df[~is_left]
     return left_df, right_df
 
-# function to divide cows into groups based on bed preference
+# function to divide cows into groups based on bed preference, one list per bed of the barn (barn.beds)
+# and a last one for the cows never in a bed
 def divide_cows(df, barn_filename):
-
-    u_cows = unique_cows(df)   #Get a list of the unique cows ID:s
-
-    barn = pd.read_csv(barn_filename, skiprows=0, sep=';', header=0)            #Read the barn beds coordinates
-    barn.columns = ['Unit', 'x1', 'x2', 'x3', 'x4', 'y1', 'y2', 'y3', 'y4']
-
-    bed1 = barn.iloc[7]         #divide the different beds
-    bed2 = barn.iloc[8]
-    bed3 = barn.iloc[9]
-    bed4 = barn.iloc[10]
-    bed5 = barn.iloc[11]
-    bed6 = barn.iloc[12]
-    bed8 = barn.iloc[13]
-    bed9 = barn.iloc[14]
-
-    beds = {0: [],   #Initiate lists of cows
-            1: [],
-            2: [],
-            3: [],
-            4: [],
-            5: [],
-            6: [],
-            7: [],
-            8: []}
-
-    for i in range(len(u_cows)):        #For each cow that has activity type "In cubicle"
-        temp = df.loc[df['tag_id'] == u_cows[i]]
-        temp = temp.loc[temp['activity_type'] == 3]
-        x, y, z = positions(temp)   #Get the positions from the cow
-        bed_count = [0]*8
-
-        for j in range(len(x)): #For each position, assign it to a bed
-            if is_inside((x[j], y[j]), bed1):
-                bed_count[0] += 1
-            elif is_inside((x[j], y[j]), bed2):
-                bed_count[1] += 1
-            elif is_inside((x[j], y[j]), bed3):
-                bed_count[2] += 1
-            elif is_inside((x[j], y[j]), bed4):
-                bed_count[3] += 1
-            elif is_inside((x[j], y[j]), bed5):
-                bed_count[4] += 1
-            elif is_inside((x[j], y[j]), bed6):
-                bed_count[5] += 1
-            elif is_inside((x[j], y[j]), bed8):
-                bed_count[6] += 1
-            elif is_inside((x[j], y[j]), bed9):
-                bed_count[7] += 1
-
-        if sum(bed_count) != 0:         #If the cow has been in any bed, append its ID to the list of the bed where it spent the most time
-            beds[bed_count.index(max(bed_count))].append(u_cows[i])
-        else:
-            beds[8].append(u_cows[i])   #If none of the cows 'in cubicle' positions could be assigned to a bed, or if there where none, assign to separate list
-
-    return list(beds.values())      #Return a list of lists of the ID:s of cows in different beds
+    if isinstance(df, st.PositionStore):
+        df = df.df
+    barn = brn.load_barn(barn_filename)            #Read the barn beds coordinates
+    codes, u_cows = pd.factorize(df['tag_id'])     #Get the unique cows ID:s
+    nb_beds = len(barn.beds)
+
+    # Zone of each "in cubicle" position and number of positions of each cow in each bed (one grouped count)
+    cubicle = (df['activity_type'] == 3).to_numpy()
+    zone = barn.zones(df['x'].to_numpy()[cubicle], df['y'].to_numpy()[cubicle]).astype(np.int64)
+    inside = zone >= brn.BED
+    bed_count = np.bincount(codes[cubicle][inside]*nb_beds + zone[inside] - brn.BED, minlength=len(u_cows)*nb_beds).reshape(len(u_cows), nb_beds)
+
+    # Each cow goes to the bed where it spent the most time, or to a separate list if it has not been in any bed
+    group = np.where(bed_count.sum(axis=1) != 0, bed_count.argmax(axis=1), nb_beds)
+    return [u_cows[group == k].tolist() for k in range(nb_beds + 1)]      #Return a list of lists of the ID:s of cows in different beds
 
 # help function
 def is_inside(pos, bed):
@@ -173,18 +124,11 @@ def is_inside(pos, bed):
     
 # function to detect and drop inactive tags for PA-data
 def detect_drop_inactive_tags(df):
-    ucows = unique_cows(df)
-    to_drop = []
-    for cow in ucows:
-        temp = df.loc[df['tag_id'] == cow]
-        x,y,z = positions(temp)
-        if abs(max(y)-min(y)) <= 1: # only check y-direction
-            to_drop.append(cow)
-    
-    for i in range(len(to_drop)):
-        df = df.drop(df[df.tag_id == to_drop[i]].index) # drop tags
-
-    return df
+    if isinstance(df, st.PositionStore):
+        df = df.df
+    stats = tag_stats(df)
+    to_drop = stats.index[stats['y_range'] <= 1] # only check y-direction
+    return remove_tags(df, to_drop) # drop tags
 
 ###############################################################################
 ####                               PLOTS                                  #####
@@ -192,8 +136,7 @@ def detect_drop_inactive_tags(df):
 
 # function to plot the outline of the barn
 def plot_barn(filename):
-        df = pd.read_csv(filename, skiprows = 0, sep = ';', header=0)
-        df.columns = ['Unit', 'x1', 'x2', 'x3', 'x4', 'y1', 'y2', 'y3','y4']
+        df = brn.load_barn(filename).table.reset_index()
         units = list(df['Unit'])
         x_1 = list(df['x1'])
         x_2 = list(df['x2'])
@@ -214,8 +157,7 @@ def plot_barn(filename):
         return fig, ax
     
 def plot_barnV2(filename):
-        df = pd.read_csv(filename, skiprows = 0, sep = ';', header=0)
-        df.columns = ['Unit', 'x1', 'x2', 'x3', 'x4', 'y1', 'y2', 'y3','y4']
+        df = brn.load_barn(filename).table.reset_index()
         units = list(df['Unit'])
         x_1 = list(df['x1'])
         x_2 = list(df['x2'])
@@ -281,65 +223,18 @@ def plot_cow(df, tag_id, filename_barn):
    
 # function to plot the distance between two cows
 def plot_distance(df, tag_id1, tag_id2):
-    cow_1 = df.loc[df['tag_id'] == tag_id1]
-    cow_2 = df.loc[df['tag_id'] == tag_id2]
-    x1,y1,z1 = positions(cow_1)
-    x2,y2,z2 = positions(cow_2)
-    
-    times_1 = list(cow_1['time'])
-    times_2 = list(cow_2['time'])
-    
-    distance_x = []
-    distance_y = []
-    
-    distance_x.append(x1[0] - x2[0]) # initial distance
-    distance_y.append(y1[0] - y2[0])
-    i = 0 # index of times_1/x1/y1
-    j = 0 # index of times_2/x2/y2
-    times_comb = []
-    times_comb.append(min(times_1[0], times_2[0]))
-    while i < len(times_1)-1 or j < len(times_2)-1:
-        if times_1[i] <= times_2[j]:           
-            if i == len(times_1)-1:# if at end of times_1
-                j = j+1
-                distance_x.append(x1[i] - x2[j]) # new distance
-                distance_y.append(y1[i] - y2[j])
-                times_comb.append(min(times_2[j],times_1[i]))
-            else:
-                i = i+1
-                distance_x.append(x1[i] - x2[j]) # new distance
-                distance_y.append(y1[i] - y2[j])
-                times_comb.append(min(times_2[j],times_1[i]))
-        else:
-            if j == len(times_2)-1: # if at end of times_2
-                i = i+1
-                distance_x.append(x1[i] - x2[j]) # new distance
-                distance_y.append(y1[i] - y2[j])
-                times_comb.append(min(times_2[j],times_1[i]))
-            else:
-                j = j+1
-                distance_x.append(x1[i] - x2[j]) # new distance
-                distance_y.append(y1[i] - y2[j])
-                times_comb.append(min(times_2[j],times_1[i]))
-
-    distance = []
-    temp = times_comb[0]
-    times_comb = [x - temp for x in times_comb] # set initial time to zero
-    times_comb_plot = [x*1/(3600*1000) for x in times_comb] 
-
-    for i in range(len(distance_x)):
-        distance.append(math.sqrt(distance_x[i]**2 + distance_y[i]**2))
+    cows = st.as_store(df)
+    times_comb, distance, i, j = pair_distance(cows, tag_id1, tag_id2)
+
+    times_comb = times_comb - times_comb[0] # set initial time to zero
+    times_comb_plot = times_comb*1/(3600*1000)
+
     fig, ax =  plt.subplots(1,figsize=(6,6))
     ax.plot(times_comb_plot, distance)
     ax.set_title('Distance between cow ' + str(tag_id1) + ' and ' + str(tag_id2))
     plt.show()
-    hist_arr = np.zeros(times_comb[-1])
-    index = 0
-    for i in range(len(times_comb)-1):
-        hist_arr[index:times_comb[i+1]] = distance[i]
-        index = times_comb[i+1]
-
-    plt.hist(hist_arr, bins=50)
+    hist_val, hist_dur = duration_weights(distance, times_comb) # each distance counts for as long as it lasts (in ms)
+    plt.hist(hist_val, bins=50, weights=hist_dur)
     plt.show()
     
 def plot_cow_PAv2(df, tag_id, filename_barn):
@@ -497,154 +392,42 @@ def plot_cow_PAA(df, tag_id):
     
 # function to plot distances (with histogram) for PA-data
 def plot_distance_PA(df, tag_id1, tag_id2):
-    cow_1 = df.loc[df['tag_id'] == tag_id1]
-    cow_2 = df.loc[df['tag_id'] == tag_id2]
-    x1,y1,z1 = positions(cow_1)
-    x2,y2,z2 = positions(cow_2)
-    
-    times_1_start = list(cow_1['start'])
-    times_1_end = list(cow_1['end'])
-    times_2_start = list(cow_2['start'])
-    times_2_end = list(cow_2['end'])
-    
-    act_1 = list(cow_1['activity_type'])
-    act_2 = list(cow_2['activity_type'])
-    
-    distance_x = []
-    distance_y = []
-    
-    distance_x.append(x1[0] - x2[0]) # initial distance
-    distance_y.append(y1[0] - y2[0])
-    i = 0 # index of times_1/x1/y1
-    j = 0 # index of times_2/x2/y2
-    act = np.ones(len(times_1_start) + len(times_2_start))
-    times_comb = []
-    times_comb.append(min(times_1_start[0], times_2_start[0]))
-    while i < len(times_1_start)-1 or j < len(times_2_start)-1:
-        if times_1_start[i] <= times_2_start[j]:           
-            if i == len(times_1_start)-1:# if at end of times_1
-                j = j+1
-                distance_x.append(x1[i] - x2[j]) # new distance
-                distance_y.append(y1[i] - y2[j])
-                times_comb.append(min(times_2_start[j],times_1_start[i]))
-            else:
-                i = i+1
-                distance_x.append(x1[i] - x2[j]) # new distance
-                distance_y.append(y1[i] - y2[j])
-                times_comb.append(min(times_2_start[j],times_1_start[i]))
-        else:
-            if j == len(times_2_start)-1: # if at end of times_2
-                i = i+1
-                distance_x.append(x1[i] - x2[j]) # new distance
-                distance_y.append(y1[i] - y2[j])
-                times_comb.append(min(times_2_start[j],times_1_start[i]))
-            else:
-                j = j+1
-                distance_x.append(x1[i] - x2[j]) # new distance
-                distance_y.append(y1[i] - y2[j])
-                times_comb.append(min(times_2_start[j],times_1_start[i]))
-        if act_1[i] == 3 or act_2[j] == 3:
-            act[i+j] = 0
-
-    distance = []
-    temp = times_comb[0]
-    times_comb = [x - temp for x in times_comb] # set initial time to zero
-    times_comb_plot = [x*1/(3600*1000) for x in times_comb] 
-
-    for i in range(len(distance_x)):
-        distance.append(math.sqrt(distance_x[i]**2 + distance_y[i]**2))
     fig, ax =  plt.subplots(2,figsize=(6,6))
+    draw_distance_PA(ax, st.as_store(df), tag_id1, tag_id2)
+    plt.show()
+
+# function to draw the distance between two cows over time and its histogram on two axes (PA-data)
+def draw_distance_PA(ax, cows, tag_id1, tag_id2):
+    times_comb, distance, i, j = pair_distance(cows, tag_id1, tag_id2)
+    act = np.ones(len(times_comb))
+    act[in_cubicle(cows, tag_id1, tag_id2, i, j)] = 0
+
+    times_comb = times_comb - times_comb[0] # set initial time to zero
+    times_comb_plot = times_comb*1/(3600*1000)
+
     ax[0].plot(times_comb_plot, distance)
     ax[0].set_title('Distance between cow ' + str(tag_id1) + ' and ' + str(tag_id2))
     ax[0].set_xlabel('Time [hours]')
     ax[0].set_ylabel('Distance [cm]')
     #plt.show()
-    hist_arr = np.zeros(times_comb[-1])
-    index = 0
-    for i in range(len(times_comb)-1):
-        if act[i] == 1:
-            hist_arr[index:times_comb[i+1]] = distance[i]
-        else:
-            hist_arr[index:times_comb[i+1]] = 0
-        index = times_comb[i+1]
-    
-
-    hist_arr = [i for i in hist_arr if i != 0]
-    ax[1].hist(hist_arr, bins=50)
+    hist_val, hist_dur = duration_weights(distance, times_comb, (act == 1) & (distance != 0))
+    ax[1].hist(hist_val, bins=50, weights=hist_dur)
     ax[1].set_ylabel('#')
     ax[1].set_xlabel('Distance [cm]')
-    plt.show()
 
 # function to plot the distance between two cows when within a certain distance
 # and when neither of the cows are sleeping
 def plot_distance_thres_PA(df, tag_id1, tag_id2, threshold):
-    cow_1 = df.loc[df['tag_id'] == tag_id1]
-    cow_2 = df.loc[df['tag_id'] == tag_id2]
-    x1,y1,z1, act1 = positions_PA(cow_1)
-    x2,y2,z2, act2 = positions_PA(cow_2)
-    
-    times_1_start = list(cow_1['start'])
-    times_1_end = list(cow_1['end'])
-    times_2_start = list(cow_2['start'])
-    times_2_end = list(cow_2['end'])
-    
-    distance_x = []
-    distance_y = []
-    
-    distance_x.append(x1[0] - x2[0]) # initial distance
-    distance_y.append(y1[0] - y2[0])
-    i = 0 # index of times_1/x1/y1
-    j = 0 # index of times_2/x2/y2
-    act = np.ones(len(times_1_start) + len(times_2_start))
-    times_comb = []
-    times_comb.append(min(times_1_start[0], times_2_start[0]))
-    while i < len(times_1_start)-1 or j < len(times_2_start)-1:
-        if times_1_start[i] <= times_2_start[j]:           
-            if i == len(times_1_start)-1:# if at end of times_1
-                j = j+1
-                distance_x.append(x1[i] - x2[j]) # new distance
-                distance_y.append(y1[i] - y2[j])
-                times_comb.append(min(times_2_start[j],times_1_start[i]))
-            else:
-                i = i+1
-                distance_x.append(x1[i] - x2[j]) # new distance
-                distance_y.append(y1[i] - y2[j])
-                times_comb.append(min(times_2_start[j],times_1_start[i]))
-        else:
-            if j == len(times_2_start)-1: # if at end of times_2
-                i = i+1
-                distance_x.append(x1[i] - x2[j]) # new distance
-                distance_y.append(y1[i] - y2[j])
-                times_comb.append(min(times_2_start[j],times_1_start[i]))
-            else:
-                j = j+1
-                distance_x.append(x1[i] - x2[j]) # new distance
-                distance_y.append(y1[i] - y2[j])
-                times_comb.append(min(times_2_start[j],times_1_start[i]))
-        if act1[i] == 3 or act2[j] == 3:
-            act[i+j] = 0
-
-    distance = []
-    temp = times_comb[0]
-    times_comb = [x - temp for x in times_comb] # set initial time to zero
-    times_copy = times_comb.copy()
-    times_comb_plot = [x*1/(3600*1000) for x in times_comb] 
-
-    for i in range(len(distance_x)):
-        distance.append(math.sqrt(distance_x[i]**2 + distance_y[i]**2))
-    
+    cows = st.as_store(df)
+    times_comb, distance, i, j = pair_distance(cows, tag_id1, tag_id2)
+    act = np.ones(len(times_comb))
+    act[in_cubicle(cows, tag_id1, tag_id2, i, j)] = 0
+
+    times_comb = times_comb - times_comb[0] # set initial time to zero
+    times_comb_plot = times_comb*1/(3600*1000)
+
     distance_copy = distance.copy()
-    
-    for i in range(len(distance_copy)):
-        if act[i] == 0:
-            distance_copy[i] = np.nan
-        elif distance_copy[i] > threshold:
-            distance_copy[i] = np.nan
-
-    for i in range(len(times_copy)):
-        if np.isnan(distance_copy[i]):
-            times_copy[i] = 0
-    
+    distance_copy[(act == 0) | (distance_copy > threshold)] = np.nan
         
     fig, ax =  plt.subplots(2,figsize=(6,6))
     ax[0].plot(times_comb_plot, distance_copy, 'go-')
@@ -652,18 +435,8 @@ def plot_distance_thres_PA(df, tag_id1, tag_id2, threshold):
     ax[0].set_xlabel('Time [hours]')
     ax[0].set_ylabel('Distance [cm]')
     #plt.show()
-    hist_arr = np.zeros(times_comb[-1])
-    index = 0
-    for i in range(len(times_comb)-1):
-        if act[i] == 1:
-            hist_arr[index:times_comb[i+1]] = distance_copy[i]
-        else:
-            hist_arr[index:times_comb[i+1]] = 0
-        index = times_comb[i+1]
-    
-
-    hist_arr = [i for i in hist_arr if i != 0]
-    ax[1].hist(hist_arr, bins=50)
+    hist_val, hist_dur = duration_weights(distance_copy, times_comb, (act == 1) & (distance_copy != 0))
+    ax[1].hist(hist_val, bins=50, weights=hist_dur)
     ax[1].set_xlabel('Distance [cm]')
     ax[1].set_ylabel('#')
     plt.show()
@@ -674,181 +447,65 @@ def plot_distance_thres_PA(df, tag_id1, tag_id2, threshold):
 ###############################################################################
 
 # function to get matrix of average distances between cows
-def get_distance(df, tag_id):
+# processes > 1 splits the pairs across that many worker processes
+def get_distance(df, tag_id, processes=1):
+    cows = st.as_store(df) # rows of each cow are contiguous, no scan per pair
     res = np.zeros((len(tag_id),len(tag_id)))
-    for k in range(len(tag_id)-1):
-        for l in range(k+1, len(tag_id)):
-            cow_1 = df.loc[df['tag_id'] == tag_id[k]]
-            cow_2 = df.loc[df['tag_id'] == tag_id[l]]
-            if cow_1.empty == False and cow_2.empty == False:
-                x1,y1,z1 = positions(cow_1)
-                x2,y2,z2 = positions(cow_2)
-                
-                times_1 = list(cow_1['time'])
-                times_2 = list(cow_2['time'])
-                
-                distance_x = []
-                distance_y = []
-                
-                distance_x.append(x1[0] - x2[0]) # initial distance
-                distance_y.append(y1[0] - y2[0])
-                i = 0 # index of times_1/x1/y1
-                j = 0 # index of times_2/x2/y2
-                times_comb = []
-                times_comb.append(min(times_1[0], times_2[0]))
-                while i < len(times_1)-1 or j < len(times_2)-1:
-                    if times_1[i] <= times_2[j]:           
-                        if i == len(times_1)-1:# if at end of times_1
-                            j = j+1
-                            distance_x.append(x1[i] - x2[j]) # new distance
-                            distance_y.append(y1[i] - y2[j])
-                            times_comb.append(times_2[j])
-                        else:
-                            i = i+1
-                            distance_x.append(x1[i] - x2[j]) # new distance
-                            distance_y.append(y1[i] - y2[j])
-                            times_comb.append(times_1[i])
-                    else:
-                        if j == len(times_2)-1: # if at end of times_2
-                            i = i+1
-                            distance_x.append(x1[i] - x2[j]) # new distance
-                            distance_y.append(y1[i] - y2[j])
-                            times_comb.append(times_1[i])
-                        else:
-                            j = j+1
-                            distance_x.append(x1[i] - x2[j]) # new distance
-                            distance_y.append(y1[i] - y2[j])
-                            times_comb.append(times_2[j])
-            
-                distance = []
-                temp = times_comb[0]
-                times_comb = [x - temp for x in times_comb] # set initial time to zero
-                for i in range(len(distance_x)):
-                    distance.append(math.sqrt(distance_x[i]**2 + distance_y[i]**2))
-
-                res[k][l] = sum(distance)/len(distance)
+    pairs = [(k, l) for k, l in par.upper_pairs(len(tag_id)) if tag_id[k] in cows and tag_id[l] in cows]
+    values = par.pair_values(pair_mean_distance, cows, tag_id, pairs, (), processes)
+    for (k, l), value in zip(pairs, values):
+        res[k][l] = value
     res_df = pd.DataFrame(data=res[0:,0:],index=tag_id, columns=tag_id)  # 1st row as the column names
     return res_df+res_df.T
+
+# average distance between two cows
+def pair_mean_distance(cows, tag_id1, tag_id2):
+    times_comb, distance, i, j = pair_distance(cows, tag_id1, tag_id2)
+    return distance.mean()
    
 # function same as get_distance() but for PA-data
 # histogram not based on distances when either of the cows are sleeping/in cubicle
-def get_distance_PA(df, tag_id):
+def get_distance_PA(df, tag_id, processes=1):
+    cows = st.as_store(df)
     res_mean = np.zeros((len(tag_id),len(tag_id)))
     res_min = np.zeros((len(tag_id),len(tag_id)))
-    for k in range(len(tag_id)-1):
-        for l in range(k+1, len(tag_id)):
-            cow_1 = df.loc[df['tag_id'] == tag_id[k]]
-            cow_2 = df.loc[df['tag_id'] == tag_id[l]]
-            if cow_1.empty == False and cow_2.empty == False:
-                x1,y1,z1,act_1 = positions_PA(cow_1)
-                x2,y2,z2,act_2 = positions_PA(cow_2)
-                
-                times_1_start = list(cow_1['start'])
-                times_1_end = list(cow_1['end'])
-                times_2_start = list(cow_2['start'])
-                times_2_end = list(cow_2['end'])
-                               
-                distance_x = []
-                distance_y = []
-                
-                distance_x.append(x1[0] - x2[0]) # initial distance
-                distance_y.append(y1[0] - y2[0])
-                i = 0 # index of times_1/x1/y1
-                j = 0 # index of times_2/x2/y2
-                act = np.ones(len(times_1_start) + len(times_2_start))
-                times_comb = []
-                times_comb.append(min(times_1_start[0], times_2_start[0]))
-                while i < len(times_1_start)-1 or j < len(times_2_start)-1:
-                    if times_1_start[i] <= times_2_start[j]:           
-                        if i == len(times_1_start)-1:# if at end of times_1
-                            j = j+1
-                            distance_x.append(x1[i] - x2[j]) # new distance
-                            distance_y.append(y1[i] - y2[j])
-                            times_comb.append(min(times_2_start[j],times_1_start[i]))
-                        else:
-                            i = i+1
-                            distance_x.append(x1[i] - x2[j]) # new distance
-                            distance_y.append(y1[i] - y2[j])
-                            times_comb.append(min(times_2_start[j],times_1_start[i]))
-                    else:
-                        if j == len(times_2_start)-1: # if at end of times_2
-                            i = i+1
-                            distance_x.append(x1[i] - x2[j]) # new distance
-                            distance_y.append(y1[i] - y2[j])
-                            times_comb.append(min(times_2_start[j],times_1_start[i]))
-                        else:
-                            j = j+1
-                            distance_x.append(x1[i] - x2[j]) # new distance
-                            distance_y.append(y1[i] - y2[j])
-                            times_comb.append(min(times_2_start[j],times_1_start[i]))
-                    if act_1[i] == 3 or act_2[j] == 3:
-                        act[i+j] = 0
-            
-                distance = []
-                temp = times_comb[0]
-                times_comb = [x - temp for x in times_comb] # set initial time to zero
-                for i in range(len(distance_x)):
-                    if act[i] > 0:
-                        distance.append(math.sqrt(distance_x[i]**2 + distance_y[i]**2))
-
-                res_mean[k][l] = sum(distance)/len(distance) # average distance
-                res_min[k][l] = min(distance) # minimum distance
+    pairs = [(k, l) for k, l in par.upper_pairs(len(tag_id)) if tag_id[k] in cows and tag_id[l] in cows]
+    values = par.pair_values(pair_distance_PA, cows, tag_id, pairs, (), processes)
+    for (k, l), value in zip(pairs, values):
+        res_mean[k][l], res_min[k][l] = value
     res_mean[np.tril_indices(res_mean.shape[0])] = np.nan
     res_min[np.tril_indices(res_min.shape[0])] = np.nan
     res_df_mean = pd.DataFrame(data=res_mean[0:,0:],index=tag_id, columns=tag_id)  # 1st row as the column names
     res_df_min = pd.DataFrame(data=res_min[0:,0:],index=tag_id, columns=tag_id)  
     return res_df_mean, res_df_min
 
+# average and minimum distance between two cows when neither is in cubicle
+def pair_distance_PA(cows, tag_id1, tag_id2):
+    times_comb, distance, i, j = pair_distance(cows, tag_id1, tag_id2)
+    distance = distance[~in_cubicle(cows, tag_id1, tag_id2, i, j)]
+    return distance.mean(), distance.min() # average distance, minimum distance
+
 # function to generate matrix of total time when cows are performing different activities 
-def diff_act_PA(df, tag_id):
+def diff_act_PA(df, tag_id, processes=1):
+    cows = st.as_store(df)
     res = np.zeros((len(tag_id),len(tag_id)))
-    for k in range(len(tag_id)-1):
-        for l in range(k+1, len(tag_id)):
-            cow_1 = df.loc[df['tag_id'] == tag_id[k]]
-            cow_2 = df.loc[df['tag_id'] == tag_id[l]]
-            if cow_1.empty == False and cow_2.empty == False:
-                x1,y1,z1,act_1 = positions_PA(cow_1)
-                x2,y2,z2,act_2 = positions_PA(cow_2)
-                
-                times_1_start = list(cow_1['start'])
-                times_1_end = list(cow_1['end'])
-                times_2_start = list(cow_2['start'])
-                times_2_end = list(cow_2['end'])
-                
-                i = 0 # index of times_1/x1/y1
-                j = 0 # index of times_2/x2/y2
-                act = 0
-                time_idx = 0
-                times_comb = []
-                times_comb.append(min(times_1_start[0], times_2_start[0]))
-                while i < len(times_1_start)-1 or j < len(times_2_start)-1:
-                    if times_1_start[i] <= times_2_start[j]:           
-                        if i == len(times_1_start)-1:# if at end of times_1
-                            j = j+1
-                            time_idx = time_idx + 1
-                            times_comb.append(min(times_2_start[j],times_1_start[i]))
-                        else:
-                            i = i+1
-                            time_idx = time_idx + 1
-                            times_comb.append(min(times_2_start[j],times_1_start[i]))
-                    else:
-                        if j == len(times_2_start)-1: # if at end of times_2
-                            i = i+1
-                            time_idx = time_idx + 1
-                            times_comb.append(min(times_2_start[j],times_1_start[i]))
-                        else:
-                            j = j+1
-                            time_idx = time_idx + 1
-                            times_comb.append(min(times_2_start[j],times_1_start[i]))
-                    if act_1[i] != 3 and act_2[j] != 3: # if neither is in cubicle
-                        if act_1[i] != act_2[j]:
-                            act = act +  times_comb[time_idx] - times_comb[time_idx-1]
-                        
-                res[k][l] = act/(1000*60) # in minutes
+    pairs = [(k, l) for k, l in par.upper_pairs(len(tag_id)) if tag_id[k] in cows and tag_id[l] in cows]
+    values = par.pair_values(pair_diff_act, cows, tag_id, pairs, (), processes)
+    for (k, l), value in zip(pairs, values):
+        res[k][l] = value
     res[np.tril_indices(res.shape[0])] = np.nan
     res_df = pd.DataFrame(data=res[0:,0:],index=tag_id, columns=tag_id)  # 1st row as the column names
     return res_df
 
+# time (in minutes) when two cows are doing different activities, neither in cubicle
+def pair_diff_act(cows, tag_id1, tag_id2):
+    times_comb, i, j = align_times(cows.column(tag_id1, cows.time_col), cows.column(tag_id2, cows.time_col))
+    act_1 = cows.column(tag_id1, 'activity_type')[i]
+    act_2 = cows.column(tag_id2, 'activity_type')[j]
+    diff = (act_1 != 3) & (act_2 != 3) & (act_1 != act_2) # if neither is in cubicle
+    act = np.diff(times_comb)[diff[1:]].sum()
+    return act/(1000*60) # in minutes
+
 def time_at_feed(df):
     u_cows = unique_cows(df)
     feed_time = [0]*len(u_cows)
@@ -861,451 +518,170 @@ def time_at_feed(df):
     return u_cows, feed_time
 
 # function to generate matrix with time spent close to each other
-def interaction_time(df, tag_id, dist):
+# computed for all the cows at once by interaction_time_grid(), same values as pair_interaction_time() for each pair
+def interaction_time(df, tag_id, dist, processes=1):
+    return interaction_time_grid(df, tag_id, dist, processes)
+
+# time (in seconds) two cows spend within dist of each other, neither in cubicle
+def pair_interaction_time(cows, tag_id1, tag_id2, dist):
+    times_comb, distance, i, j = pair_distance(cows, tag_id1, tag_id2)
+    close = ~in_cubicle(cows, tag_id1, tag_id2, i, j) & (distance <= dist)
+    time_close = np.diff(times_comb)[close[:-1]].sum() # add time spent close
+    return time_close/1000
+
+# function same as interaction_time() computed for all the cows at once
+# the time is cut at every event of any cow, over each piece the cows of a pair are where the walk of
+# pair_interaction_time() puts them; positions are bucketed into cells of size dist and only cows in the
+# same or adjacent cells are compared, instead of every pair of cows
+def interaction_time_grid(df, tag_id, dist, processes=1):
+    cows = st.as_store(df)
     res = np.zeros((len(tag_id),len(tag_id)))
-    for k in range(len(tag_id)-1):
-        for l in range(k+1, len(tag_id)):
-            cow_1 = df.loc[df['tag_id'] == tag_id[k]]
-            cow_2 = df.loc[df['tag_id'] == tag_id[l]]
-            if cow_1.empty == False and cow_2.empty == False:
-                x1,y1,z1,act_1 = positions_PA(cow_1)
-                x2,y2,z2,act_2 = positions_PA(cow_2)
-                
-                times_1_start = list(cow_1['start'])
-                times_1_end = list(cow_1['end'])
-                times_2_start = list(cow_2['start'])
-                times_2_end = list(cow_2['end'])
-                
-                distance_x = []
-                distance_y = []
-                
-                distance_x.append(x1[0] - x2[0]) # initial distance
-                distance_y.append(y1[0] - y2[0])
-                i = 0 # index of times_1/x1/y1
-                j = 0 # index of times_2/x2/y2
-                time_close = 0 # time spent close to each other
-                act = np.ones(len(times_1_start) + len(times_2_start))
-                times_comb = []
-                times_comb.append(min(times_1_start[0], times_2_start[0]))
-                while i < len(times_1_start)-1 or j < len(times_2_start)-1:
-                    if times_1_start[i] <= times_2_start[j]:           
-                        if i == len(times_1_start)-1:# if at end of times_1
-                            j = j+1
-                            distance_x.append(x1[i] - x2[j]) # new distance
-                            distance_y.append(y1[i] - y2[j])
-                            times_comb.append(min(times_2_start[j],times_1_start[i]))
-                        else:
-                            i = i+1
-                            distance_x.append(x1[i] - x2[j]) # new distance
-                            distance_y.append(y1[i] - y2[j])
-                            times_comb.append(min(times_2_start[j],times_1_start[i]))
-                    else:
-                        if j == len(times_2_start)-1: # if at end of times_2
-                            i = i+1
-                            distance_x.append(x1[i] - x2[j]) # new distance
-                            distance_y.append(y1[i] - y2[j])
-                            times_comb.append(min(times_2_start[j],times_1_start[i]))
-                        else:
-                            j = j+1
-                            distance_x.append(x1[i] - x2[j]) # new distance
-                            distance_y.append(y1[i] - y2[j])
-                            times_comb.append(min(times_2_start[j],times_1_start[i]))
-                    if act_1[i] == 3 or act_2[j] == 3:
-                        act[i+j] = 0
-            
-                temp = times_comb[0]
-                times_comb = [x - temp for x in times_comb] # set initial time to zero
-                for i in range(len(distance_x)-1):
-                    if act[i] > 0:
-                        temp_dist = math.sqrt(distance_x[i]**2 + distance_y[i]**2)
-                        if temp_dist <= dist:
-                            time_close = time_close + (times_comb[i+1]-times_comb[i]) # add time spent close                             
-
-                res[k][l] = time_close/1000
-                
+    present = [n for n, tag in enumerate(tag_id) if tag in cows]
+    if len(present) > 1:
+        tags = [tag_id[n] for n in present]
+        cuts = np.unique(np.concatenate([cows.column(tag, cows.time_col) for tag in tags]))
+        size = max(1, 1000000 // len(tags)) # pieces of time per chunk, bounds the memory used
+        chunks = [cuts[c:c + size + 1] for c in range(0, len(cuts) - 1, size)]
+        for value in par.chunk_values(close_durations, cows, chunks, (tags, dist), processes):
+            res[np.ix_(present, present)] += value
+
+    res = res/1000
     res[np.tril_indices(res.shape[0])] = np.nan
     res_df = pd.DataFrame(data=res[0:,0:],index=tag_id, columns=tag_id)  # 1st row as the column names
     return res_df
 
+# state of the cows over the pieces of time [times[g], times[g+1][, as in the walk of align_times():
+# number of steps done, time of the last step, rows of the last known and next positions and whether
+# the cow has started (first event) and not yet ended (last event)
+def piece_states(cows, tags, times):
+    start = times[:-1]
+    shape = (len(start), len(tags))
+    steps = np.zeros(shape, dtype=np.int64)
+    last = np.full(shape, -np.inf)
+    rows = np.zeros((2,) + shape, dtype=np.int64)
+    started = np.zeros(shape, dtype=bool)
+    alive = np.zeros(shape, dtype=bool)
+    offset = 0
+    for n, tag in enumerate(tags):
+        t = cows.column(tag, cows.time_col)
+        done = np.searchsorted(t[:-1], start, side='right') # a step of a cow leaves the time it is at
+        steps[:, n] = done
+        last[done > 0, n] = t[done[done > 0] - 1]
+        rows[0, :, n] = offset + np.maximum(done - 1, 0) # last known position
+        rows[1, :, n] = offset + done # next position (the last one once all the steps are done)
+        started[:, n] = start >= t[0]
+        alive[:, n] = start < t[-1]
+        offset += len(t)
+    return steps, last, rows, started, alive
+
+# time (in ms) each pair of cows is within dist of each other, neither in cubicle, over the pieces of time
+# [times[g], times[g+1][ (all the events of the cows of tags are cut points)
+# for the pair (a, b), a before b in tags, the cow whose last step is the latest (b if equal) is at its last
+# known position and the other one at its next position; the pair covers the time from the first event of
+# either cow to the last event of the first cow to end, and cubicle is not checked before its second step
+def close_durations(cows, times, tags, dist):
+    n_cows = len(tags)
+    count = np.zeros((n_cows, n_cows))
+    steps, last, rows, started, alive = piece_states(cows, tags, times)
+    duration = np.diff(times).astype(np.float64)
+    x_all = np.concatenate([cows.column(tag, 'x') for tag in tags]).astype(np.float64)
+    y_all = np.concatenate([cows.column(tag, 'y') for tag in tags]).astype(np.float64)
+    act_all = np.concatenate([cows.column(tag, 'activity_type') for tag in tags])
+
+    kind, g_idx, cow = np.nonzero(np.broadcast_to(alive, rows.shape)) # both positions of each cow not ended
+    row = rows[kind, g_idx, cow]
+    x = x_all[row]
+    y = y_all[row]
+    if len(cow) == 0:
+        return count
+    cell = dist if dist > 0 else 1
+    cell_x = np.floor(x/cell).astype(np.int64)
+    cell_y = np.floor(y/cell).astype(np.int64)
+    cell_x -= cell_x.min() - 1 # margin so that a neighbouring cell never wraps to another column or time
+    cell_y -= cell_y.min() - 1
+    height = cell_y.max() + 2
+    width = cell_x.max() + 2
+    key = (g_idx*width + cell_x)*height + cell_y
+
+    order = np.argsort(key, kind='stable') # points sorted by key, the searches below are then in order
+    key, kind, g_idx, cow, row, x, y = key[order], kind[order], g_idx[order], cow[order], row[order], x[order], y[order]
+    for dx in (-1, 0, 1):
+        target = key + dx*height # the three cells dy = -1, 0, 1 of a column are consecutive keys
+        lo = np.searchsorted(key, target - 1, side='left')
+        hi = np.searchsorted(key, target + 1, side='right')
+        n = hi - lo
+        if n.sum() == 0:
+            continue
+        src = np.repeat(np.arange(len(key)), n)
+        dst = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + np.repeat(lo, n)
+        keep = cow[src] < cow[dst] # each pair once
+        src = src[keep]
+        dst = dst[keep]
+        g = g_idx[src]
+        a = cow[src]
+        b = cow[dst]
+        a_next = last[g, b] >= last[g, a] # b did the latest step, a is at its next position
+        keep = (kind[src] == a_next) & (kind[dst] != a_next) & (started[g, a] | started[g, b])
+        src, dst, g, a, b = src[keep], dst[keep], g[keep], a[keep], b[keep]
+        cubicle = (act_all[row[src]] == 3) | (act_all[row[dst]] == 3)
+        cubicle &= steps[g, a] + steps[g, b] > 1 # the first piece of a pair is never excluded
+        close = ~cubicle & (np.sqrt((x[src] - x[dst])**2 + (y[src] - y[dst])**2) <= dist)
+        count += np.bincount(a[close]*n_cows + b[close], weights=duration[g[close]], minlength=n_cows*n_cows).reshape(n_cows, n_cows)
+    return count
+
 #Function to extract velocity vectors based on PA-data
-def vector_analysis(df, tag_id, threshold):
+def vector_analysis(df, tag_id, threshold, processes=1):
+    cows = st.as_store(df)
     res_mat = np.zeros((len(tag_id),len(tag_id)))
-    for k in range(len(tag_id)-1):
-        for l in range(k+1, len(tag_id)):
-            cow_1 = df.loc[df['tag_id'] == tag_id[k]]
-            cow_2 = df.loc[df['tag_id'] == tag_id[l]]
-            x1,y1,z1, act1 = positions_PA(cow_1)
-            x2,y2,z2, act2 = positions_PA(cow_2)
-            
-            times_1_start = list(cow_1['start'])
-            times_1_end = list(cow_1['end'])
-            times_2_start = list(cow_2['start'])
-            times_2_end = list(cow_2['end'])
-            
-            distance_x = []
-            distance_y = []
-            
-            distance_x.append(x1[0] - x2[0]) # initial distance
-            distance_y.append(y1[0] - y2[0])
-            i = 0 # index of times_1/x1/y1
-            j = 0 # index of times_2/x2/y2
-            act = np.ones(len(times_1_start) + len(times_2_start))
-            times_comb = []
-            times_comb.append(min(times_1_start[0], times_2_start[0]))
-            x_prod = np.ones(len(times_1_start) + len(times_2_start))
-            
-            while i < len(times_1_start)-2 or j < len(times_2_start)-2:
-                if times_1_start[i] <= times_2_start[j]:           
-                    if i == len(times_1_start)-2:# if at end of times_1
-                        j = j+1
-                        distance_x.append(x1[i] - x2[j]) # new distance
-                        distance_y.append(y1[i] - y2[j])
-                        times_comb.append(min(times_2_start[j],times_1_start[i]))
-                        arr1 = np.array([x1[i + 1] - x1[i], y1[i + 1] - y1[i]])
-                        arr2 = np.array([x2[j + 1] - x2[j], y2[j + 1] - y2[j]])
-        
-                        norm1 = np.linalg.norm(arr1)
-                        norm2 = np.linalg.norm(arr2)
-        
-                        if norm1 != 0 and norm2 != 0:
-                            arr1 = arr1 / np.linalg.norm(arr1)
-                            arr2 = arr2 / np.linalg.norm(arr2)
-        
-                            temp_x = np.cross(arr1, arr2)
-                            if temp_x>1:
-                                temp_x = 1
-                            x_prod[i + j] = np.arcsin(temp_x)
-                        else:
-                            x_prod[i + j] = np.nan
-        
-                    else:
-                        i = i+1
-                        distance_x.append(x1[i] - x2[j]) # new distance
-                        distance_y.append(y1[i] - y2[j])
-                        times_comb.append(min(times_2_start[j],times_1_start[i]))
-                        arr1 = np.array([x1[i+1]-x1[i], y1[i+1] - y1[i]])
-                        arr2 = np.array([x2[j+1]-x2[j], y2[j+1] - y2[j]])
-        
-                        norm1 = np.linalg.norm(arr1)
-                        norm2 = np.linalg.norm(arr2)
-        
-                        if norm1 != 0 and norm2 != 0:
-                            arr1 = arr1 / np.linalg.norm(arr1)
-                            arr2 = arr2 / np.linalg.norm(arr2)
-        
-                            temp_x = np.cross(arr1, arr2)
-                            if temp_x>1:
-                                temp_x = 1
-                            x_prod[i + j] = np.arcsin(temp_x)
-                        else:
-                            x_prod[i + j] = np.nan
-        
-                else:
-                    if j == len(times_2_start)-2: # if at end of times_2
-                        i = i+1
-                        distance_x.append(x1[i] - x2[j]) # new distance
-                        distance_y.append(y1[i] - y2[j])
-                        times_comb.append(min(times_2_start[j],times_1_start[i]))
-                        arr1 = np.array([x1[i + 1] - x1[i], y1[i + 1] - y1[i]])
-                        arr2 = np.array([x2[j + 1] - x2[j], y2[j + 1] - y2[j]])
-        
-                        norm1 = np.linalg.norm(arr1)
-                        norm2 = np.linalg.norm(arr2)
-        
-                        if norm1 != 0 and norm2 != 0:
-                            arr1 = arr1 / np.linalg.norm(arr1)
-                            arr2 = arr2 / np.linalg.norm(arr2)
-        
-                            temp_x = np.cross(arr1, arr2)
-                            if temp_x>1:
-                                temp_x = 1
-                            x_prod[i + j] = np.arcsin(temp_x)
-                        else:
-                            x_prod[i + j] = np.nan
-                    else:
-                        j = j+1
-                        distance_x.append(x1[i] - x2[j]) # new distance
-                        distance_y.append(y1[i] - y2[j])
-                        times_comb.append(min(times_2_start[j],times_1_start[i]))
-                        arr1 = np.array([x1[i + 1] - x1[i], y1[i + 1] - y1[i]])
-                        arr2 = np.array([x2[j + 1] - x2[j], y2[j + 1] - y2[j]])
-        
-                        norm1 = np.linalg.norm(arr1)
-                        norm2 = np.linalg.norm(arr2)
-        
-                        if norm1 != 0 and norm2 != 0:
-                            arr1 = arr1 / np.linalg.norm(arr1)
-                            arr2 = arr2 / np.linalg.norm(arr2)
-        
-                            temp_x = np.cross(arr1, arr2)
-                            if temp_x>1:
-                                temp_x = 1
-                            x_prod[i + j] = np.arcsin(temp_x)
-                        else:
-                            x_prod[i + j] = np.nan
-                if act1[i] == 3 or act2[j] == 3:
-                    act[i+j] = 0
-        
-            distance = []
-            
-            temp = times_comb[0]
-            times_comb = [x - temp for x in times_comb] # set initial time to zero
-            times_copy = times_comb.copy()
-        
-            for i in range(len(distance_x)):
-                distance.append(math.sqrt(distance_x[i]**2 + distance_y[i]**2))
-            
-            distance_copy = distance.copy()
-            
-            for i in range(len(distance_copy)):
-                if act[i] == 0:
-                    x_prod[i] = np.nan
-                elif distance_copy[i] > threshold or x_prod[i] > 15*180/math.pi:
-                    x_prod[i] = np.nan
-        
-            res = []
-            for i in range(len(times_copy)):
-                if not np.isnan(x_prod[i]):
-                    res.append(times_copy[i])
-                    
-            res_mat[k][l] = len(res)
+    pairs = par.upper_pairs(len(tag_id))
+    values = par.pair_values(pair_vector_count, cows, tag_id, pairs, (threshold,), processes)
+    for (k, l), value in zip(pairs, values):
+        res_mat[k][l] = value
                 
     res_mat[np.tril_indices(res_mat.shape[0])] = np.nan
     res_df = pd.DataFrame(data=res_mat[0:,0:],index=tag_id, columns=tag_id)  # 1st row as the column names
 
     return res_df
 
+# number of events when two cows are close and moving in the same direction, neither in cubicle
+def pair_vector_count(cows, tag_id1, tag_id2, threshold):
+    times_comb, distance, x_prod, speed1, speed2, i, j = pair_vectors(cows, tag_id1, tag_id2)
+    if len(times_comb) == 0:
+        return 0
+    x_prod[in_cubicle(cows, tag_id1, tag_id2, i, j)] = np.nan
+    x_prod[(distance > threshold) | (x_prod > 15*180/math.pi)] = np.nan
+    return np.count_nonzero(~np.isnan(x_prod))
+
 #Function to extract velocity vectors based on PA-data
-def vector_analysis_FA(df, tag_id, threshold, speed_thres): # vector analysis for FA-data (included speed)
+# returns the matrix of the number of co-moving events and a table of the co-moving runs of each pair:
+# one row per run of events less than time_thresh (ms) apart, with its starting time and number of events
+def vector_analysis_FA(df, tag_id, threshold, speed_thres, time_thresh=10*1000): # vector analysis for FA-data (included speed)
+    cows = st.as_store(df)
     res_mat = np.zeros((len(tag_id),len(tag_id)))
-    res_mat_time = np.zeros((len(tag_id),len(tag_id), 100000))
+    events = []
     for k in range(len(tag_id)-1):
         for l in range(k+1, len(tag_id)):
-            cow_1 = df.loc[df['tag_id'] == tag_id[k]]
-            cow_2 = df.loc[df['tag_id'] == tag_id[l]]
-            x1,y1,z1 = positions(cow_1)
-            x2,y2,z2 = positions(cow_2)
-            
-            times_1_start = list(cow_1['time'])
-            times_2_start = list(cow_2['time'])
-            
-            temp_time1 = []
-            temp_time2 = []
-            
-            distance_x = []
-            distance_y = []
-            speed1 = []
-            speed2 = []
-            
-            distance_x.append(x1[0] - x2[0]) # initial distance
-            distance_y.append(y1[0] - y2[0])
-            arr1 = np.array([x1[1] - x1[0], y1[1] - y1[0]])
-            arr2 = np.array([x2[1] - x2[0], y2[1] - y2[0]])
-            speed1.append(math.sqrt(arr1[0]**2 + arr1[1]**2)/(times_1_start[1] - times_1_start[0]))
-            speed2.append(math.sqrt(arr2[0]**2 + arr2[1]**2)/(times_2_start[1] - times_2_start[0]))
-            i = 0 # index of times_1/x1/y1
-            j = 0 # index of times_2/x2/y2
-
-            times_comb = []
-            times_comb.append(min(times_1_start[0], times_2_start[0]))
-            x_prod = np.ones(len(times_1_start) + len(times_2_start))
-            
-            while i < len(times_1_start)-2 or j < len(times_2_start)-2:
-                if times_1_start[i] <= times_2_start[j]:           
-                    if i == len(times_1_start)-2:# if at end of times_1
-                        j = j+1
-                        distance_x.append(x1[i] - x2[j]) # new distance
-                        distance_y.append(y1[i] - y2[j])
-                        times_comb.append(min(times_2_start[j],times_1_start[i]))
-                        arr1 = np.array([x1[i + 1] - x1[i], y1[i + 1] - y1[i]])
-                        arr2 = np.array([x2[j + 1] - x2[j], y2[j + 1] - y2[j]])
-                        speed1.append(math.sqrt(arr1[0]**2 + arr1[1]**2)/(times_1_start[i+1] - times_1_start[i]))
-                        speed2.append(math.sqrt(arr2[0]**2 + arr2[1]**2)/(times_2_start[j+1] - times_2_start[j]))
-                        temp_time1.append(times_1_start[i])
-                        temp_time2.append(times_2_start[j])
-        
-                        norm1 = np.linalg.norm(arr1)
-                        norm2 = np.linalg.norm(arr2)
-        
-                        if norm1 != 0 and norm2 != 0:
-                            arr1 = arr1 / np.linalg.norm(arr1)
-                            arr2 = arr2 / np.linalg.norm(arr2)
-        
-                            temp_x = np.cross(arr1, arr2)
-                            if temp_x>1:
-                                temp_x = 1
-                            x_prod[i + j] = np.arcsin(temp_x)
-                        else:
-                            x_prod[i + j] = np.nan
-        
-                    else:
-                        i = i+1
-                        distance_x.append(x1[i] - x2[j]) # new distance
-                        distance_y.append(y1[i] - y2[j])
-                        times_comb.append(min(times_2_start[j],times_1_start[i]))
-                        arr1 = np.array([x1[i+1]-x1[i], y1[i+1] - y1[i]])
-                        arr2 = np.array([x2[j+1]-x2[j], y2[j+1] - y2[j]])
-                        
-                        speed1.append(math.sqrt(arr1[0]**2 + arr1[1]**2)/(times_1_start[i+1] - times_1_start[i]))
-                        speed2.append(math.sqrt(arr2[0]**2 + arr2[1]**2)/(times_2_start[j+1] - times_2_start[j]))
-                        temp_time1.append(times_1_start[i])
-                        temp_time2.append(times_2_start[j])
-        
-                        norm1 = np.linalg.norm(arr1)
-                        norm2 = np.linalg.norm(arr2)
-        
-                        if norm1 != 0 and norm2 != 0:
-                            arr1 = arr1 / np.linalg.norm(arr1)
-                            arr2 = arr2 / np.linalg.norm(arr2)
-        
-                            temp_x = np.cross(arr1, arr2)
-                            if temp_x>1:
-                                temp_x = 1
-                            x_prod[i + j] = np.arcsin(temp_x)
-                        else:
-                            x_prod[i + j] = np.nan
-        
-                else:
-                    if j == len(times_2_start)-2: # if at end of times_2
-                        i = i+1
-                        distance_x.append(x1[i] - x2[j]) # new distance
-                        distance_y.append(y1[i] - y2[j])
-                        times_comb.append(min(times_2_start[j],times_1_start[i]))
-                        arr1 = np.array([x1[i + 1] - x1[i], y1[i + 1] - y1[i]])
-                        arr2 = np.array([x2[j + 1] - x2[j], y2[j + 1] - y2[j]])
-                        
-                        speed1.append(math.sqrt(arr1[0]**2 + arr1[1]**2)/(times_1_start[i+1] - times_1_start[i]))
-                        speed2.append(math.sqrt(arr2[0]**2 + arr2[1]**2)/(times_2_start[j+1] - times_2_start[j]))
-                        temp_time1.append(times_1_start[i])
-                        temp_time2.append(times_2_start[j])
-        
-                        norm1 = np.linalg.norm(arr1)
-                        norm2 = np.linalg.norm(arr2)
-        
-                        if norm1 != 0 and norm2 != 0:
-                            arr1 = arr1 / np.linalg.norm(arr1)
-                            arr2 = arr2 / np.linalg.norm(arr2)
-        
-                            temp_x = np.cross(arr1, arr2)
-                            if temp_x>1:
-                                temp_x = 1
-                            x_prod[i + j] = np.arcsin(temp_x)
-                        else:
-                            x_prod[i + j] = np.nan
-                    else:
-                        j = j+1
-                        distance_x.append(x1[i] - x2[j]) # new distance
-                        distance_y.append(y1[i] - y2[j])
-                        times_comb.append(min(times_2_start[j],times_1_start[i]))
-                        arr1 = np.array([x1[i + 1] - x1[i], y1[i + 1] - y1[i]])
-                        arr2 = np.array([x2[j + 1] - x2[j], y2[j + 1] - y2[j]])
-                        
-                        speed1.append(math.sqrt(arr1[0]**2 + arr1[1]**2)/(times_1_start[i+1] - times_1_start[i]))
-                        speed2.append(math.sqrt(arr2[0]**2 + arr2[1]**2)/(times_2_start[j+1] - times_2_start[j]))
-                        temp_time1.append(times_1_start[i])
-                        temp_time2.append(times_2_start[j])
-        
-                        norm1 = np.linalg.norm(arr1)
-                        norm2 = np.linalg.norm(arr2)
-        
-                        if norm1 != 0 and norm2 != 0:
-                            arr1 = arr1 / np.linalg.norm(arr1)
-                            arr2 = arr2 / np.linalg.norm(arr2)
-        
-                            temp_x = np.cross(arr1, arr2)
-                            if temp_x>1:
-                                temp_x = 1
-                            x_prod[i + j] = np.arcsin(temp_x)
-                        else:
-                            x_prod[i + j] = np.nan
-        
-            distance = []
-            res_time = []
-            check_time = 0
-            
-            temp = times_comb[0]
-            times_comb = [x - temp for x in times_comb] # set initial time to zero
-            times_copy = times_comb.copy()
-        
-            for i in range(len(distance_x)):
-                distance.append(math.sqrt(distance_x[i]**2 + distance_y[i]**2))
-            
-            distance_copy = distance.copy()
-            
-            for i in range(len(distance_copy)):
-                if distance_copy[i] > threshold or x_prod[i] > 15*180/math.pi: # within 14 degrees
-                    x_prod[i] = np.nan
-                elif speed1[i] > speed_thres:
-                    x_prod[i] = np.nan
-                elif speed2[i] > speed_thres:
-                    x_prod[i] = np.nan
-                else:
-                   res_time.append(min(temp_time1[i], temp_time2[i]))
-                   check_time += 1
-        
-            res = []
-            for i in range(len(times_copy)):
-                if not np.isnan(x_prod[i]):
-                    res.append(times_copy[i])
-            if check_time > 0:
-                if check_time > 1:
-                    for i in range(len(res_time)):
-                        res_mat_time[k][l][i] = res_time[i]
-                else:
-                    res_mat_time[i] = res_time
-            res_mat[k][l] = len(res)
+            times_comb, distance, x_prod, speed1, speed2, i, j = pair_vectors(cows, tag_id[k], tag_id[l])
+
+            x_prod[(distance > threshold) | (x_prod > 15*180/math.pi)] = np.nan # within 14 degrees
+            x_prod[(speed1 > speed_thres) | (speed2 > speed_thres)] = np.nan
+            res_time = times_comb[~np.isnan(x_prod)]
+            res_mat[k][l] = len(res_time)
+
+            if len(res_time) > 0:
+                starts = np.r_[0, np.flatnonzero(np.diff(res_time) >= time_thresh) + 1] # first event of each run
+                counts = np.diff(np.r_[starts, len(res_time)])
+                events.append(pd.DataFrame({'tag_id_1': tag_id[k], 'tag_id_2': tag_id[l],
+                                            'time': res_time[starts], 'count': counts}))
                 
     res_mat[np.tril_indices(res_mat.shape[0])] = np.nan
     res_df = pd.DataFrame(data=res_mat[0:,0:],index=tag_id, columns=tag_id)  # 1st row as the column names
-    
-    temp_shape = res_mat_time.shape
-    new = res_mat_time.reshape(-1,temp_shape[2], order = "C")
-
-    time_thresh = 10*1000
-    temp_shape = new.shape
-    result = np.zeros(temp_shape)
-    result_count = np.zeros(temp_shape)
-
-    for i in range(len(new[:, 0])):
-        temp = new[i, :]
-        temp = temp[temp != 0]
-        if temp.shape != (0,):
-            result_vector = []
-            counter = 1
-            count_vector =[]
-            for j in range(len(temp)-1, 1, -1):
-                if not temp[j]-temp[j-1] < time_thresh:
-                    count_vector.append(counter)
-                    counter = 1
-                    result_vector.append(temp[j])
-                else:
-                    counter +=1
-            result_vector.append(temp[0])
-            count_vector.append(counter)            
-            result[i, 0:len(result_vector)] = result_vector
-            result_count[i, 0:len(count_vector)] = count_vector
-        else:
-            print("EMPTY")
-
-    new = result
-
-    col1 = []
-    col2 = []
-    for i in range(len(tag_id)):
-        temp = [tag_id[i]]
-        temp = temp*(len(tag_id))
-        col1.extend(temp)
-        for j in range(len(tag_id)):
-            col2.append(tag_id[j])
-  
-    col1 = np.transpose(np.asarray(col1))
-    col2 = np.transpose(np.asarray(col2))
-    result_count = np.insert(result_count, 0, col2, axis=1)
-    result_count = np.insert(result_count, 0, col1, axis=1)
-    new = np.insert(new, 0, col2, axis=1)
-    new = np.insert(new, 0, col1, axis=1)
-                
-    return res_df, new, result_count
+
+    if len(events) > 0:
+        events = pd.concat(events, ignore_index=True)
+    else:
+        events = pd.DataFrame(columns=['tag_id_1', 'tag_id_2', 'time', 'count'])
+    return res_df, events
 
 
 # function to get intersection between two dataframes
@@ -1681,6 +1057,74 @@ def animate_cows(df, cowID_1, cowID_2, barn_filename, save_path='n'):
 ####                           OTHER                                       ####
 ###############################################################################
 
+# function to align the events of two cows: same steps as walking through both (sorted) time lists
+# with one index each, always moving the index with the earliest time (the first cow on ties)
+# returns the combined times and, for each combined time, the index of each cow
+def align_times(times_1, times_2):
+    times_1 = np.asarray(times_1)
+    times_2 = np.asarray(times_2)
+    steps_1 = times_1[:-1] # a step of a cow leaves the time it is at
+    steps_2 = times_2[:-1]
+    is_step_1 = np.zeros(len(steps_1) + len(steps_2), dtype=bool)
+    is_step_1[np.arange(len(steps_1)) + np.searchsorted(steps_2, steps_1, side='left')] = True
+    idx_1 = np.r_[0, np.cumsum(is_step_1)]
+    idx_2 = np.r_[0, np.cumsum(~is_step_1)]
+    times_comb = np.minimum(times_1[idx_1], times_2[idx_2])
+    return times_comb, idx_1, idx_2
+
+# distance between two cows at each of their combined times
+def pair_distance(cows, tag_id1, tag_id2):
+    times_comb, i, j = align_times(cows.column(tag_id1, cows.time_col), cows.column(tag_id2, cows.time_col))
+    distance_x = cows.column(tag_id1, 'x')[i].astype(np.float64) - cows.column(tag_id2, 'x')[j]
+    distance_y = cows.column(tag_id1, 'y')[i].astype(np.float64) - cows.column(tag_id2, 'y')[j]
+    return times_comb, np.sqrt(distance_x**2 + distance_y**2), i, j
+
+# values of a series changing at the combined times and how long each value lasts, to use as
+# histogram weights instead of repeating each value once per millisecond
+# values lasting no time, not kept (keep == False) or nan are left out
+def duration_weights(values, times_comb, keep=None):
+    durations = np.diff(times_comb)
+    values = np.asarray(values)[:-1]
+    kept = (durations > 0) & ~np.isnan(values)
+    if keep is not None:
+        kept &= np.asarray(keep)[:-1]
+    return values[kept], durations[kept]
+
+# combined times when either cow is in cubicle (the initial time is never excluded)
+def in_cubicle(cows, tag_id1, tag_id2, i, j):
+    cubicle = (cows.column(tag_id1, 'activity_type')[i] == 3) | (cows.column(tag_id2, 'activity_type')[j] == 3)
+    cubicle[0] = False
+    return cubicle
+
+# distance, angle between the directions (nan if one cow is not moving) and speeds of two cows
+# at each combined time, the direction of a cow being the move to its next position
+def pair_vectors(cows, tag_id1, tag_id2):
+    t1 = cows.column(tag_id1, cows.time_col)
+    t2 = cows.column(tag_id2, cows.time_col)
+    if len(t1) < 2 or len(t2) < 2:
+        empty = np.zeros(0)
+        return empty, empty, empty, empty, empty, empty.astype(int), empty.astype(int)
+    times_comb, i, j = align_times(t1[:-1], t2[:-1])
+    x1 = cows.column(tag_id1, 'x').astype(np.float64)
+    y1 = cows.column(tag_id1, 'y').astype(np.float64)
+    x2 = cows.column(tag_id2, 'x').astype(np.float64)
+    y2 = cows.column(tag_id2, 'y').astype(np.float64)
+    distance = np.sqrt((x1[i] - x2[j])**2 + (y1[i] - y2[j])**2)
+
+    arr1 = np.stack([x1[i + 1] - x1[i], y1[i + 1] - y1[i]], axis=1)
+    arr2 = np.stack([x2[j + 1] - x2[j], y2[j + 1] - y2[j]], axis=1)
+    norm1 = np.linalg.norm(arr1, axis=1)
+    norm2 = np.linalg.norm(arr2, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed1 = norm1/(t1[i + 1] - t1[i])
+        speed2 = norm2/(t2[j + 1] - t2[j])
+        arr1 = arr1/norm1[:, None]
+        arr2 = arr2/norm2[:, None]
+        x_prod = np.arcsin(np.minimum(arr1[:, 0]*arr2[:, 1] - arr1[:, 1]*arr2[:, 0], 1))
+    x_prod[(norm1 == 0) | (norm2 == 0)] = np.nan
+    x_prod[0] = 1 # no direction compared at the initial time
+    return times_comb, distance, x_prod, speed1, speed2, i, j
+
 # function to extract position data of a dataframe, for PA-data    
 def positions_PA(df):
     x = list(df['x'])
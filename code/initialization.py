@@ -7,128 +7,139 @@
 # It can also fill in the missing data to reduce the computation's inaccuracies 
 ######################################################################################################
 
+import os
+import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-from scipy.interpolate import Akima1DInterpolator
 import numpy as np
+from pandas.api.types import union_categoricals
 import functions as func
+import storage
+import store as st
+import barn as brn
+import interpolation as interp
 
 pd.options.mode.chained_assignment = None  # default='warn'
 
+# Interpolation of the missing seconds in fill_data: "none", "linear", "akima" or "pchip"
+FILL_METHOD = "akima"
+# Longest time gap (in seconds) filled by fill_data, None to fill all the gaps
+FILL_MAX_GAP = None
+
 # Function create a dataframe from a CSV file
 def csv_read(file):
     header_list = ["data_entity", "tag_id", "tag_string", "epoch_time", "x", "y", "z"]
-    df = pd.read_csv(file, names=header_list)
+    df = storage.read_csv(file, header_list) # binary copy of the file when available
     df = func.detect_drop_inactive_tags(df) #Drop inactive tags
     return df
 
+# Function to get the FA file of a day
+def fa_file(date):
+    return "../data/FA_" + date.strftime("%Y%m%d") + "T000000UTC.csv"
+
+# Function create the dataframe of a day (see csv_read)
+def read_day(date):
+    return csv_read(fa_file(date))
+
+# Function to get the days between two dates (both included) that have a FA file
+def days(start, end):
+    dates = [start + datetime.timedelta(days=k) for k in range((end - start).days + 1)]
+    return [date for date in dates if os.path.isfile(fa_file(date))]
+
+# Function to go through the days between two dates, gives (date, dataframe) for each day
+# the next days (prefetch) are read in the background while the current one is used
+def iter_days(start, end, load=read_day, prefetch=1):
+    dates = deque(days(start, end))
+    executor = ThreadPoolExecutor(max(prefetch, 1))
+    try:
+        loading = deque()
+        while dates or loading:
+            while dates and len(loading) <= prefetch:
+                date = dates.popleft()
+                loading.append((date, executor.submit(load, date)))
+            date, future = loading.popleft()
+            yield date, future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+# Function to read the days between two dates at the same time (workers threads) into a single dataframe sorted by time
+def read_days(start, end, load=read_day, workers=4):
+    dates = days(start, end)
+    if len(dates) == 0:
+        return pd.DataFrame()
+    with ThreadPoolExecutor(max(min(workers, len(dates)), 1)) as executor:
+        frames = list(executor.map(load, dates))
+
+    # Same categories on every day, so that the text columns stay categorical
+    for name in frames[0].columns:
+        if all(isinstance(f[name].dtype, pd.CategoricalDtype) for f in frames):
+            categories = union_categoricals([f[name] for f in frames]).categories
+            for f in frames:
+                f[name] = f[name].cat.set_categories(categories)
+    df = pd.concat(frames, ignore_index=True)
+    if 'epoch_time' in df.columns and not df['epoch_time'].is_monotonic_increasing:
+        df = df.sort_values(by=['epoch_time'], kind='stable', ignore_index=True)
+    return df
+
 # Function to test to get all the histogram of 6 cows
 def csv_read_bis(file):
     header_list = ["data_entity", "tag_id", "tag_string", "epoch_time", "x", "y", "z"]
-    df = pd.read_csv(file, names=header_list)
+    df = storage.read_csv(file, header_list) # binary copy of the file when available
     df = df[df['tag_id']>2433132] # there is 6 cows above this tag id
     return df
 
-# Function to retrieve cow information
-def csv_read_cow(file):
-    header_list = ["data_entity", "tag_id", "tag_string", "epoch_time", "x", "y", "z","rounded_time"]
-    df = pd.read_csv(file, names=header_list)
-    return df
+# Function to read only the given cows between the starting and ending epoch time (in seconds)
+def csv_read_window(file, cow_ids, e_min, e_max):
+    header_list = ["data_entity", "tag_id", "tag_string", "epoch_time", "x", "y", "z"]
+    return storage.read_csv_filtered(file, header_list, cow_ids, "epoch_time", e_min*1000, e_max*1000)
+
+# Function to get the zone of each row of the dataframe (see barn.py for the codes)
+def zones(df_cow,barn):
+    return barn.zones(df_cow['x'].to_numpy(), df_cow['y'].to_numpy())
 
 # Function to get the feeding areas coordinates and return the matching rows of the dataframe
 def feeding_area(df_cow,barn):
-    # Feeding area 1
-    f1_x1 = int(barn[barn['Unit']=='feed1']['x1'])
-    f1_x2 = int(barn[barn['Unit']=='feed1']['x3'])
-    f1_y1 = int(barn[barn['Unit']=='feed1']['y1'])
-    f1_y2 = int(barn[barn['Unit']=='feed1']['y2'])
-
-    # Feeding area 2
-    f2_x1 = int(barn[barn['Unit']=='feed2']['x1'])
-    f2_x2 = int(barn[barn['Unit']=='feed2']['x3'])
-    f2_y1 = int(barn[barn['Unit']=='feed2']['y1'])
-    f2_y2 = int(barn[barn['Unit']=='feed2']['y2'])
-
-    return df_cow[((df_cow['x'].between(f1_x1,f1_x2)) & (df_cow['y'].between(f1_y1,f1_y2))) | ((df_cow['x'].between(f2_x1,f2_x2)) & (df_cow['y'].between(f2_y1,f2_y2)))]
+    return df_cow[zones(df_cow,barn) == brn.FEED]
 
 # Function to get the bedding areas coordinates and return the matching rows of the dataframe
 def bedding_area(df_cow,barn):
-    ls = []
-    units = list(barn['Unit'])
-    # Get index of each bed
-    for i in range (len(units)):
-        if units[i].startswith('bed'):
-            ls.append(i)
-
-    # Set lists of the coordinates of all beds
-    x_1 = list(barn[barn.index.isin(ls)]['x1'])
-    x_2 = list(barn[barn.index.isin(ls)]['x3'])
-    y_1 = list(barn[barn.index.isin(ls)]['y1'])
-    y_2 = list(barn[barn.index.isin(ls)]['y2'])
-
-
-    bet_x, bet_y = [], []
-
-    for i in range (len(df_cow)):
-        for j in range (len(x_1)):
-            # If a row of the dataframe is between the coordinates
-            if x_1[j] <= df_cow['x'][i] <= x_2[j] and y_1[j] <= df_cow['y'][i] <= y_2[j]:
-                bet_x.append(df_cow['x'][i])
-                bet_y.append(df_cow['y'][i])    
-
-    return df_cow[(df_cow['x'].isin(bet_x)) & (df_cow['y'].isin(bet_y))]
+    return df_cow[zones(df_cow,barn) >= brn.BED]
 
 # Function to get the cubicle areas coordinates and return the matching rows of the dataframe
 def cubicle_area(df_cow,barn):
-    r1_x1 = int(barn[barn['Unit']=='cubicle1']['x1'])
-    r1_x2 = int(barn[barn['Unit']=='cubicle1']['x3'])
-    r1_y1 = int(barn[barn['Unit']=='cubicle1']['y1'])
-    r1_y2 = int(barn[barn['Unit']=='cubicle1']['y2'])
-
-    r2_x1 = int(barn[barn['Unit']=='cubicle2']['x1'])
-    r2_x2 = int(barn[barn['Unit']=='cubicle2']['x3'])
-    r2_y1 = int(barn[barn['Unit']=='cubicle2']['y1'])
-    r2_y2 = int(barn[barn['Unit']=='cubicle2']['y2'])
-
-    return df_cow[((df_cow['x'].between(r1_x1,r1_x2)) & (df_cow['y'].between(r1_y1,r1_y2))) | ((df_cow['x'].between(r2_x1,r2_x2)) & (df_cow['y'].between(r2_y1,r2_y2)))]
+    return df_cow[zones(df_cow,barn) == brn.CUBICLE]
 
 # Function to get the alley coordinates and return the matching rows of the dataframe
 def alley(df_cow,barn):
-    df1 = feeding_area(df_cow,barn)
-    df2 = bedding_area(df_cow,barn)
-    df3 = cubicle_area(df_cow,barn)
-
-    df4 = pd.concat([df1,df2,df3])
-    return df_cow.merge(df4, how = 'outer' ,indicator='Ind').loc[lambda x : x['Ind']=='left_only'].drop(columns=['Ind'])
+    return df_cow[zones(df_cow,barn) == brn.ALLEY]
 
 # Function to  return the matching rows of the dataframe between the given coordinates
 def custom_area(df_cow,x1,x2,y1,y2):
     return df_cow[((df_cow['x'].between(x1,x2)) & (df_cow['y'].between(y1,y2)))]
 
 # Function to delimite the barn and the different areas
-def area_delimitation(df_cow,area):
-    barn = pd.read_csv("../data/barn.csv", skiprows = 0, sep = ';', header=0)
-    barn.columns = ['Unit', 'x1', 'x2', 'x3', 'x4', 'y1', 'y2', 'y3','y4']
+def area_delimitation(df_cow,area,barn=brn.BARN_FILE):
+    barn = brn.load_barn(barn) # read only once
 
-    b1_x1 = int(barn[barn['Unit']=='Base']['x1'])
-    b1_x2 = int(barn[barn['Unit']=='Base']['x3'])
-    b1_y1 = int(barn[barn['Unit']=='Base']['y1'])
-    b1_y2 = int(barn[barn['Unit']=='Base']['y2'])
+    zone = zones(df_cow,barn) # zone of each row, computed once
 
-    ind = df_cow[(df_cow['x'] < b1_x1) | (df_cow['x'] > b1_x2) | (df_cow['y'] < b1_y1) | (df_cow['y'] > b1_y2)].index
+    ind = df_cow[zone == brn.OUTSIDE].index
     df_cow.drop(ind , inplace=True)
     df_cow.reset_index(drop=True, inplace=True)
+    zone = zone[zone != brn.OUTSIDE]
 
     if area == "feeding":
-        return feeding_area(df_cow,barn)
+        return df_cow[zone == brn.FEED]
 
     elif area == "bedding":
-        return bedding_area(df_cow,barn)
+        return df_cow[zone >= brn.BED]
 
     elif area == "cubicle":
-        return cubicle_area(df_cow,barn)
+        return df_cow[zone == brn.CUBICLE]
 
     elif area == "alley":
-        return alley(df_cow,barn)
+        return df_cow[zone == brn.ALLEY]
     
     return df_cow
 
@@ -140,50 +151,61 @@ def create_cow(cow_id,df,e_min,e_max,area):
     df_cow['rounded_time'] = (df_cow['epoch_time']/1000).astype(int) # rounded time to remove the milliseconds 
     return df_cow
 
+# Function create the dataframes of several cows at once (create_cow, custom_area and fill_data of each cow)
+# custom gives the coordinates (x1, x2, y1, y2) of a custom area, method and max_gap are given to fill_data
+# returns {tag_id: dataframe of the cow}
+def create_cows(cow_ids,df,e_min,e_max,area,custom=None,method=None,max_gap=None):
+    df_cows = df[(df['tag_id'].isin(cow_ids)) & (df['epoch_time']>=e_min*1000) & (df['epoch_time']<e_max*1000)]
+    df_cows = area_delimitation(df_cows,area)
+    df_cows.reset_index(drop=True, inplace=True)
+    df_cows['rounded_time'] = (df_cows['epoch_time']/1000).astype(int) # rounded time to remove the milliseconds 
+    if custom is not None:
+        df_cows = custom_area(df_cows,*custom)
+    df_cows = fill_data(df_cows,area,method,max_gap) # all the cows filled at once
+
+    cows = st.PositionStore(df_cows,'rounded_time')
+    return {cow_id: cows.cow(cow_id).reset_index(drop=True) for cow_id in cow_ids}
+
 # Function to add the missing coordinates to the dataframe by data interpolation
-def create_coordinates(df_cow,i,time_gap,t,t2,x2,y2):
-    time = 1000
-    ls = []
-    td = int(time_gap[i])
-    for j in range (1,td):
-        ind = np.where(t2 == t[i-1]+j)
-        xf = int(x2[ind])
-        yf = int(y2[ind])
-        ls.append(['FA_ADD', df_cow['tag_id'].loc[i], df_cow['tag_string'].loc[i], df_cow['epoch_time'].loc[i-1] + time, round(xf), round(yf), df_cow['z'].loc[i], int((df_cow['epoch_time'].loc[i-1] + time)/1000)])
-        time += 1000
-    return ls
+# Returns one row for each missing second of each time gap of more than 1 second (up to max_gap seconds),
+# for all the cows of the dataframe (sorted by tag and time) at once, method and max_gap are FILL_METHOD and FILL_MAX_GAP by default
+def create_coordinates(df_cow,method=None,max_gap=None):
+    method = FILL_METHOD if method is None else method
+    max_gap = FILL_MAX_GAP if max_gap is None else max_gap
+    tag = df_cow['tag_id'].to_numpy()
+    t = df_cow['rounded_time'].to_numpy()
+    last = np.r_[tag[1:] != tag[:-1], True] # last row of each cow
+    before, after, j = interp.missing_seconds(t, last, max_gap)
+
+    epoch = df_cow['epoch_time'].to_numpy()[before] + 1000*j
+    columns = [np.full(len(j), 'FA_ADD', dtype=object),
+               tag[after],
+               df_cow['tag_string'].to_numpy()[after],
+               epoch,
+               interp.interpolate(t, df_cow['x'].to_numpy(), last, before, after, j, method).astype(int),
+               interp.interpolate(t, df_cow['y'].to_numpy(), last, before, after, j, method).astype(int),
+               df_cow['z'].to_numpy()[after],
+               (epoch/1000).astype(int)]
+    return pd.DataFrame(dict(zip(df_cow.columns, columns)))
 
 # Function compute the missing data
-def fill_data(df_cow,area):
+# The dataframe can hold several cows, they are all filled at once
+# method and max_gap are read from FILL_METHOD and FILL_MAX_GAP when they are not given
+def fill_data(df_cow,area,method=None,max_gap=None):
+    method = FILL_METHOD if method is None else method
+    max_gap = FILL_MAX_GAP if max_gap is None else max_gap
     if df_cow.empty is False:    
-        df_cow.drop_duplicates(subset ='rounded_time', keep = 'first', inplace = True)
+        df_cow = df_cow.sort_values(by=['tag_id','rounded_time'], kind='stable')
+        df_cow.drop_duplicates(subset =['tag_id','rounded_time'], keep = 'first', inplace = True)
         df_cow.reset_index(drop=True, inplace=True)
 
-        # Create subset of all time gaps of more than 1 second
-        time_gap = df_cow['rounded_time'].diff()[df_cow['rounded_time'].diff()>1]
-        difference = df_cow[df_cow['rounded_time'].diff()>1]
-        index = difference.index
-        list_coord = []
-
-        t = df_cow['rounded_time'].to_numpy()
-        t2 = np.arange(t[0], t[-1], 0.1)
-        t2 = np.around(t2, decimals=1)
-
-        # Data interpolation
-        x = df_cow['x'].to_numpy()
-        x2 = Akima1DInterpolator(t, x)(t2)
-        y = df_cow['y'].to_numpy()
-        y2 = Akima1DInterpolator(t, y)(t2)
-
-        # For each gap in the dataframe (>1 second)
-        for i in index:
-            list_coord += create_coordinates(df_cow,i,time_gap,t,t2,x2,y2)
-
-        df_cow = df_cow.append(pd.DataFrame(list_coord, columns=df_cow.columns), ignore_index=True)
+        # Data interpolation, only evaluated at the missing seconds
+        if method != "none" and len(df_cow) > 1:
+            df_cow = pd.concat([df_cow, create_coordinates(df_cow,method,max_gap)], ignore_index=True)
         # Make sure the coordinates are not out of range
         df_cow = area_delimitation(df_cow,area)
-        df_cow.drop_duplicates(subset ='rounded_time', keep = 'first', inplace = True)
-        df_cow = df_cow.sort_values(by=['rounded_time'])
+        df_cow.drop_duplicates(subset =['tag_id','rounded_time'], keep = 'first', inplace = True)
+        df_cow = df_cow.sort_values(by=['tag_id','rounded_time'])
         df_cow.reset_index(drop=True, inplace=True)
 
     return df_cow
\ No newline at end of file
@@ -9,179 +9,95 @@
 
 from tkinter import *
 import tkcalendar as tkdate
-import initialization as init, distance as dist
-from pathlib import Path
+import distance as dist
 from progress.bar import Bar
-import functions as func
+import barn as brn
+import cache
+import pipeline as pl
+import worker as wk
 import datetime
 
 def main_frame():
 
-    # Load data file to create dataframe
-    def clicked_file(): 
-        ### From Torsten and Björn code ###
-        lbl_file.config(text="Wait...")
-        lbl_file.update_idletasks()
-        y = str(cal.get_date().year) # get year, month and day from calendar
-        mo = str(cal.get_date().month)
-        d = str(cal.get_date().day)
-        if len(mo) == 1:
-            mo = "0"+mo
-        if len(d) == 1:
-            d = "0"+d
-        
-        FA_file = "../data/FA_"+y+mo+d+"T000000UTC.csv"
-        ###
-
-        global df
-        df = init.csv_read_bis(FA_file) #Test (6 cows)
-        #df = init.csv_read(FA_file) # All the cows
-
-        lbl_file.config(text="Data loaded")
-        btn_histo.configure(state = NORMAL) 
-        btn_all_histo.configure(state = NORMAL)
-        # Create folders if not exist to store data
-        Path("../data/" + str(cal.get_date()) + '/cows').mkdir(parents=True, exist_ok=True)
-        Path("../data/" + str(cal.get_date()) + '/merged data').mkdir(parents=True, exist_ok=True)
-        Path("../data/" + str(cal.get_date()) + '/histograms/left').mkdir(parents=True, exist_ok=True)
-        Path("../data/" + str(cal.get_date()) + '/histograms/right').mkdir(parents=True, exist_ok=True)
-
-    # Create cow dataframe 
-    def compute_cow(path,cow_id,e_min,e_max,area):
-        # Check if the cow data has already been computed 
-        if Path(path).is_file() or Path(path.replace(area,'all')).is_file():
-            # If found file area == all but given area != all
-            if Path(path).is_file() != True:
-                cow = init.csv_read_cow(path.replace(area,'all'))
-                if area.startswith("custom"):
-                    cow = init.custom_area(cow,int(entry_x1.get()),int(entry_x2.get()),int(entry_y1.get()),int(entry_y2.get()))
-                    cow.to_csv (r''+ path, index = False, header=False)
-                else:   
-                    cow = init.area_delimitation(cow,area)
-                    cow.to_csv (r''+ path, index = False, header=False)
-            else:
-                cow = init.csv_read_cow(path)
-        else:
-            cow = init.create_cow(cow_id, df,e_min,e_max,area)
-            if area.startswith("custom"):
-                cow = init.custom_area(cow,int(entry_x1.get()),int(entry_x2.get()),int(entry_y1.get()),int(entry_y2.get()))
-            cow = init.fill_data(cow,area)
-            # Save cow data
-            cow.to_csv (r''+ path, index = False, header=False)
-        return cow
-
-    # Create histogram for a pair of cows
-    def get_histogram():
-        lbl_file.config(text="Processing...  0/2")
-        lbl_file.update_idletasks()
-        global df
+    barn = brn.load_barn(brn.BARN_FILE) # barn geometry shared by all the computations
+    cows_cache = cache.CowCache() # cow dataframes already computed
+    worker = wk.Worker() # the computations run in the background, the window stays responsive
+    processes = 1 # no process pool is forked from the Tk process (it runs several threads)
+    bars = {}
 
-        # get staring time from the entry
+    # Settings of a run from the entries of the window
+    def get_settings():
         t_min = datetime.datetime.strptime(entry_time1.get(), '%H:%M').time()
-        e_min = int((datetime.datetime(cal.get_date().year,cal.get_date().month,cal.get_date().day,t_min.hour,t_min.minute)- datetime.datetime(1970,1,1)).total_seconds())
-
-        # get ending time from the entry
         t_max = datetime.datetime.strptime(entry_time2.get(), '%H:%M').time()
-        e_max = int((datetime.datetime(cal.get_date().year,cal.get_date().month,cal.get_date().day,t_max.hour,t_max.minute) + datetime.timedelta(minutes=1) - datetime.datetime(1970,1,1)).total_seconds())
-
-        area = area_var.get()
-        if area == "custom":
-            area = "custom_" + str(entry_x1.get()) + '_' + str(entry_x2.get()) + '_' + str(entry_y1.get()) + '_' + str(entry_y2.get())
-
-        c1 = compute_cow('../data/' + str(cal.get_date()) + '/cows' + '/' + str(entry_cow1.get()) + '_' + t_min.strftime("%H%M") + '_' + t_max.strftime("%H%M") + '_' + area + '.csv', int(entry_cow1.get()),e_min,e_max,area)
-
-        lbl_file.config(text="Processing...  1/2")
-        lbl_file.update_idletasks()
-
-        # if the "both" checkbox is not checked
-        if check_area_var.get() == 0:
-            area = "all"
-        c2 = compute_cow('../data/' + str(cal.get_date()) + '/cows' + '/' + str(entry_cow2.get()) + '_' + t_min.strftime("%H%M") + '_' + t_max.strftime("%H%M") + '_' + area + '.csv', int(entry_cow2.get()),e_min,e_max,area)
+        custom = None
+        if area_var.get() == "custom":
+            custom = (entry_x1.get(), entry_x2.get(), entry_y1.get(), entry_y2.get())
+        return pl.Settings(cal.get_date(), t_min, t_max, area_var.get(), custom, check_area_var.get() == 1, check_save_var.get() == 1, entry_bar.get())
+
+    # Show the messages of the worker: progress, end of a job or error
+    def poll_worker():
+        for kind, name, value, done in worker.poll():
+            if kind == 'progress':
+                k, n = value
+                if name not in bars:
+                    bars[name] = Bar(name, max=max(n, 1))
+                bars[name].goto(min(k, bars[name].max))
+                lbl_file.config(text=name + "...  " + str(k) + '/' + str(n))
+            else:
+                if name in bars:
+                    bars.pop(name).finish()
+                if kind == 'done':
+                    lbl_file.config(text="Done")
+                    if done is not None:
+                        done(value)
+                elif kind == 'cancelled':
+                    lbl_file.config(text="Cancelled")
+                else:
+                    lbl_file.config(text="Error: " + str(value))
+        window.after(100, poll_worker)
 
-        lbl_file.config(text="Processing...  2/2")
-        lbl_file.update_idletasks()
+    # Load data file to create dataframe
+    def clicked_file(): 
+        lbl_file.config(text="Wait...")
+        date = cal.get_date()
 
-        res = dist.compare(c1,c2)
-        res = dist.compute_distance(res)
+        def loaded(data):
+            global df, FA_file
+            df = data
+            FA_file = pl.fa_file(date)
+            lbl_file.config(text="Data loaded")
+            btn_histo.configure(state = NORMAL) 
+            btn_all_histo.configure(state = NORMAL)
 
-        if check_save_var.get() == 1:
-            if check_area_var.get() == 1:
-                area_check = area + "_both"
-            else:
-                area_check = area
-    
-            res.to_csv(r''+ '../data/' + str(cal.get_date()) + '/merged data' + '/merged_' + str(entry_cow1.get()) + '_' + str(entry_cow2.get()) + '_' + t_min.strftime("%H%M") + '_' + t_max.strftime("%H%M") + '_' + area_check + '.csv', index = False, header=True)
-
-        lbl_file.config(text="Done")
-        dist.histogram(res,1,NONE,int(entry_bar.get()),t_min,t_max)
-
-    # Get histograms for cows on one side of the barn
-    def compute_side(list_side,e_min,e_max,t_min,t_max,nb_histo,side,i):
-        area = area_var.get()
-        if area == "custom":
-            area = "custom_" + str(entry_x1.get()) + '_' + str(entry_x2.get()) + '_' + str(entry_y1.get()) + '_' + str(entry_y2.get())
-        if check_area_var.get() == 1:
-            area_check = area + "_both"
-        else:
-            area_check = area
-
-
-        while len(list_side)>0:
-            cow_id1 = list_side[0]
-            list_side.remove(list_side[0])
-            c1 = compute_cow('../data/' + str(cal.get_date()) + '/cows' + '/' + str(cow_id1) + '_' + t_min.strftime("%H%M") + '_' + t_max.strftime("%H%M") + '_' + area + '.csv', cow_id1,e_min,e_max,area)
-
-            for cow_id2 in list_side:
-                if check_area_var.get() == 0:
-                    c2 = compute_cow('../data/' + str(cal.get_date()) + '/cows' + '/' + str(cow_id2) + '_' + t_min.strftime("%H%M") + '_' + t_max.strftime("%H%M") + '_all.csv', cow_id2,e_min,e_max,'all')
-                else:
-                    c2 = compute_cow('../data/' + str(cal.get_date()) + '/cows' + '/' + str(cow_id2) + '_' + t_min.strftime("%H%M") + '_' + t_max.strftime("%H%M") + '_' + area + '.csv', cow_id2,e_min,e_max,area)
+        worker.submit("Loading", lambda progress, cancel: pl.load_day(date), done=loaded)
 
-                res = dist.compare(c1,c2)
-                res = dist.compute_distance(res)
-                if check_save_var.get() == 1:
-                    res.to_csv(r''+ '../data/' + str(cal.get_date()) + '/merged data/merged_' + str(cow_id1) + '_' + str(cow_id2) + '_' + t_min.strftime("%H%M") + '_' + t_max.strftime("%H%M") + '_' + area_check + '.csv', index = False, header=True)
-                dist.histogram(res,0,'../data/' + str(cal.get_date()) + '/histograms/' + side + '/' + str(cow_id1) + '_' + str(cow_id2) + '_' + t_min.strftime("%H%M") + '_' + t_max.strftime("%H%M") + '_' + area_check + '.png',int(entry_bar.get()),t_min,t_max)
+    # Create histogram for a pair of cows
+    def get_histogram():
+        settings = get_settings()
+        cow_id1 = int(entry_cow1.get())
+        cow_id2 = int(entry_cow2.get())
 
-                lbl_file.config(text="Processing...  " + str(i) + '/' + str(nb_histo))
-                lbl_file.update_idletasks()
-                i+=1
-        return i
+        def job(progress, cancel):
+            return pl.Pipeline(settings, cows_cache, processes, progress, cancel).pair_histogram(cow_id1, cow_id2)
 
+        # the histogram is shown by the Tk thread
+        worker.submit("Processing", job, done=lambda res: dist.histogram(res,1,NONE,settings.nb_bar,settings.t_min,settings.t_max))
 
+    # Get histograms for all the pairs of cows on each side of the barn
     def get_all_histograms():
-        global df
+        settings = get_settings()
+        data = df
 
-        # get staring time from the entry
-        t_min = datetime.datetime.strptime(entry_time1.get(), '%H:%M').time()
-        e_min = int((datetime.datetime(cal.get_date().year,cal.get_date().month,cal.get_date().day,t_min.hour,t_min.minute)- datetime.datetime(1970,1,1)).total_seconds())
+        def job(progress, cancel):
+            pipeline = pl.Pipeline(settings, cows_cache, processes, progress, cancel)
+            pipeline.all_histograms(data, barn)
+            return pipeline.render_histograms()
 
-        # get ending time from the entry
-        t_max = datetime.datetime.strptime(entry_time2.get(), '%H:%M').time()
-        e_max = int((datetime.datetime(cal.get_date().year,cal.get_date().month,cal.get_date().day,t_max.hour,t_max.minute) + datetime.timedelta(minutes=1) - datetime.datetime(1970,1,1)).total_seconds())
-
-        # Separate left cows and right cows
-        df_left, df_right = func.left_right(df, '../data/barn.csv')
-        list_cow_left = df_left.tag_id.unique().tolist()
-        list_cow_right = df_right.tag_id.unique().tolist()
-
-        nb_cows_left = len(list_cow_left)
-        nb_cows_right = len(list_cow_right)
-        nb_histo = 0
-
-        # determind the number of histogram to print it
-        if nb_cows_left:
-            for i in range (1,nb_cows_left):
-                nb_histo += i
-        if nb_cows_right:
-            for i in range (1,nb_cows_right):
-                nb_histo += i
-
-        i = 0
-        i = compute_side(list_cow_left,e_min,e_max,t_min,t_max,nb_histo,"left",i)
-        i = compute_side(list_cow_right,e_min,e_max,t_min,t_max,nb_histo,"right",i)
-        
-        lbl_file.config(text="Done")
+        worker.submit("Processing", job)
+
+    # Stop the current computation
+    def cancel_job():
+        worker.stop()
 
     # Quit the interface
     def quit_me():
@@ -301,7 +217,11 @@ def main_frame():
     btn_all_histo = Button(window, state = DISABLED, text = "Get all histograms", bg='white', command = get_all_histograms)
     btn_all_histo.place(relx = 0.6, rely = 0.75)
 
+    btn_cancel = Button(window, state = NORMAL, text = "Cancel", bg='white', command = cancel_job)
+    btn_cancel.place(relx = 0.8, rely = 0.85)
+
     lbl_file = Label(window,text = "", bg='white')
     lbl_file.place(relx = 0.45, rely = 0.85)
-            
+
+    window.after(100, poll_worker)
     window.mainloop()
\ No newline at end of file
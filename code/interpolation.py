@@ -0,0 +1,127 @@
+######################################################################################################
+# Title: interpolation.py
+# Description:
+# Interpolation of the missing seconds of the positions, for all the cows at once.
+# The data of every cow is put one after the other (sorted by tag and time) and the derivatives
+# of the cubic methods (Akima, PCHIP) are computed with the same formulas as scipy, but for all
+# the cows in a single pass, and only evaluated at the missing seconds.
+######################################################################################################
+
+import numpy as np
+
+METHODS = ["none", "linear", "akima", "pchip"]
+
+# Function to get the missing seconds of every cow: row before the gap, row after it and offset (1, 2, ...)
+# t: times (in seconds) of all the cows, last: True on the last row of each cow (no gap after it)
+# gaps of more than max_gap seconds are not filled (None for no limit)
+def missing_seconds(t, last, max_gap=None):
+    gap = np.diff(t)
+    keep = (gap > 1) & ~last[:-1]
+    if max_gap is not None:
+        keep &= gap <= max_gap
+    before = np.flatnonzero(keep)
+    nb = gap[before] - 1 # number of missing seconds in each gap
+    j = np.arange(nb.sum()) - np.repeat(np.cumsum(nb) - nb, nb) + 1 # 1, 2, ... within each gap
+    before = np.repeat(before, nb)
+    return before, before + 1, j
+
+# Function to get the first and last row of each cow and the number of the cow of each row
+def cow_bounds(last):
+    ends = np.flatnonzero(last) + 1
+    starts = np.r_[0, ends[:-1]]
+    cow = np.repeat(np.arange(len(starts)), ends - starts)
+    return starts, ends, cow
+
+# Function to compute the Akima derivative at each point (as scipy Akima1DInterpolator)
+def akima_derivatives(t, v, last):
+    starts, ends, cow = cow_bounds(last)
+    n = ends - starts
+    m = np.zeros(len(t))
+    m[:-1] = np.diff(v)/np.diff(t) # slope after each point, meaningless on the last point of a cow
+
+    # slopes of each cow with two more on each side: cow c uses ext[starts[c] + 3*c : ends[c] + 3*c + 3]
+    ext = np.zeros(len(t) + 3*len(starts))
+    rows = np.flatnonzero(~last)
+    ext[rows + 3*cow[rows] + 2] = m[rows]
+    e = starts + 3*np.arange(len(starts))
+    long = n >= 3
+    el = e[long]
+    nl = n[long]
+    ext[el + 1] = 2.*ext[el + 2] - ext[el + 3]
+    ext[el] = 2.*ext[el + 1] - ext[el + 2]
+    ext[el + nl + 1] = 2.*ext[el + nl] - ext[el + nl - 1]
+    ext[el + nl + 2] = 2.*ext[el + nl + 1] - ext[el + nl]
+
+    k = np.arange(len(t)) + 3*cow # ext[k + i] is the slope i - 2 around the point
+    d = .5*(ext[k + 3] + ext[k])
+    f1 = np.abs(ext[k + 3] - ext[k + 2])
+    f2 = np.abs(ext[k + 1] - ext[k])
+    f12 = f1 + f2
+    limit = 1e-9*np.maximum.reduceat(f12, starts) if len(t) else np.zeros(0)
+    defined = f12 > limit[cow]
+    d[defined] = (f1[defined]*ext[k + 1][defined] + f2[defined]*ext[k + 2][defined])/f12[defined]
+
+    two = starts[n == 2] # only one slope: linear
+    d[two] = m[two]
+    d[two + 1] = m[two]
+    return d
+
+# Function to compute the derivative at the first or last point of a cow for PCHIP (one-sided three-point estimate)
+def pchip_edge(h0, h1, m0, m1):
+    d = ((2*h0 + h1)*m0 - h0*m1)/(h0 + h1)
+    mask = np.sign(d) != np.sign(m0)
+    mask2 = (np.sign(m0) != np.sign(m1)) & (np.abs(d) > 3.*np.abs(m0))
+    d[(~mask) & mask2] = 3.*m0[(~mask) & mask2]
+    d[mask] = 0.
+    return d
+
+# Function to compute the PCHIP derivative at each point (as scipy PchipInterpolator)
+def pchip_derivatives(t, v, last):
+    starts, ends, cow = cow_bounds(last)
+    n = ends - starts
+    h = np.ones(len(t))
+    m = np.zeros(len(t))
+    h[:-1] = np.diff(t)
+    m[:-1] = np.diff(v)/h[:-1]
+
+    d = np.zeros(len(t))
+    inner = np.flatnonzero(~last & ~np.isin(np.arange(len(t)), starts)) # neither first nor last of a cow
+    h0, h1, m0, m1 = h[inner - 1], h[inner], m[inner - 1], m[inner]
+    w1 = 2*h1 + h0
+    w2 = h1 + 2*h0
+    condition = (np.sign(m0) != np.sign(m1)) | (m0 == 0) | (m1 == 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        whmean = (w1/m0 + w2/m1)/(w1 + w2)
+    d[inner] = np.where(condition, 0., 1.0/whmean)
+
+    first = starts[n >= 3]
+    end = ends[n >= 3] - 1
+    d[first] = pchip_edge(h[first], h[first + 1], m[first], m[first + 1])
+    d[end] = pchip_edge(h[end - 1], h[end - 2], m[end - 1], m[end - 2])
+
+    two = starts[n == 2] # only two points: linear
+    d[two] = m[two]
+    d[two + 1] = m[two]
+    return d
+
+# Function to evaluate the cubic Hermite polynomial of the gaps at the missing seconds (as scipy PPoly)
+def hermite(t, v, d, before, after, j):
+    dx = t[after] - t[before]
+    slope = (v[after] - v[before])/dx
+    c = (d[before] + d[after] - 2*slope)/dx
+    c0 = c/dx
+    c1 = (slope - d[before])/dx - c
+    s = j.astype(float)
+    return ((v[before] + d[before]*s) + c1*(s*s)) + c0*(s*s*s)
+
+# Function to interpolate the values of all the cows at their missing seconds with the given method
+def interpolate(t, v, last, before, after, j, method):
+    t = np.asarray(t, dtype=float)
+    v = np.asarray(v, dtype=float)
+    if method == "linear":
+        return v[before] + (v[after] - v[before])/(t[after] - t[before])*j
+    if method == "akima":
+        return hermite(t, v, akima_derivatives(t, v, last), before, after, j)
+    if method == "pchip":
+        return hermite(t, v, pchip_derivatives(t, v, last), before, after, j)
+    raise ValueError("Unknown interpolation method: " + str(method) + " (" + ", ".join(METHODS) + ")")
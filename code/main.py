@@ -7,4 +7,5 @@
 
 import interface as inter
 
-inter.main_frame()
+if __name__ == "__main__": # worker processes started with spawn import this module again
+    inter.main_frame()
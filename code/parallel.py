@@ -0,0 +1,134 @@
+######################################################################################################
+# Title: parallel.py
+# Description:
+# Runs a pair metric of functions.py (pair_mean_distance, pair_interaction_time...) over a list of
+# pairs of cows (or a metric of all the cows over chunks of time), either in this process or split
+# across a pool of worker processes.
+# The workers read the positions from shared memory instead of receiving pickled dataframes.
+# The preprocessing of the cows (create_cow, custom_area, fill_data) can be split the same way.
+######################################################################################################
+
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, wait
+import store as st
+import barn as brn
+import initialization as init
+
+COLUMNS = ['x', 'y', 'activity_type']
+CANCEL_POLL = 0.1 # seconds between two checks of the cancel event while waiting for a pool
+
+# Raised when a run has been cancelled (see pipeline.Pipeline)
+class Cancelled(Exception):
+    pass
+
+# Function to stop if the run has been cancelled, cancel is a threading.Event (or None)
+def check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise Cancelled()
+
+worker_cows = None
+worker_blocks = []
+
+# Function run once in each worker process to attach to the shared positions
+def attach_worker(spec):
+    global worker_cows, worker_blocks
+    worker_cows, worker_blocks = st.attach(spec)
+
+# Function to compute a metric for a chunk of pairs in a worker process
+def run_chunk(pair_func, tag_pairs, args):
+    return [pair_func(worker_cows, tag_id1, tag_id2, *args) for tag_id1, tag_id2 in tag_pairs]
+
+# Function to compute pair_func(cows, tag_id[k], tag_id[l], *args) for each (k, l) in pairs
+# the pairs are split into chunks across processes when processes > 1, results keep the order of pairs
+def pair_values(pair_func, cows, tag_id, pairs, args=(), processes=1):
+    tag_pairs = [(tag_id[k], tag_id[l]) for k, l in pairs]
+    if processes <= 1 or len(tag_pairs) < 2:
+        return [pair_func(cows, tag_id1, tag_id2, *args) for tag_id1, tag_id2 in tag_pairs]
+
+    columns = [cows.time_col] + [c for c in COLUMNS if cows.has_column(c)]
+    spec, blocks = cows.share(columns)
+    try:
+        chunks = np.array_split(np.arange(len(tag_pairs)), min(len(tag_pairs), processes*4)) # several chunks per worker to balance the load
+        with ProcessPoolExecutor(processes, initializer=attach_worker, initargs=(spec,)) as executor:
+            futures = [executor.submit(run_chunk, pair_func, [tag_pairs[p] for p in chunk], args) for chunk in chunks]
+            values = []
+            for future in futures:
+                values += future.result()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return values
+
+# Function to compute chunk_func(cows, chunk, *args) for each chunk (e.g. pieces of time for all the cows)
+# the chunks are split across processes when processes > 1, results keep the order of chunks
+def chunk_values(chunk_func, cows, chunks, args=(), processes=1):
+    if processes <= 1 or len(chunks) < 2:
+        return [chunk_func(cows, chunk, *args) for chunk in chunks]
+
+    columns = [cows.time_col] + [c for c in COLUMNS if cows.has_column(c)]
+    spec, blocks = cows.share(columns)
+    try:
+        with ProcessPoolExecutor(processes, initializer=attach_worker, initargs=(spec,)) as executor:
+            futures = [executor.submit(run_chunk_func, chunk_func, chunk, args) for chunk in chunks]
+            values = [future.result() for future in futures]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return values
+
+# Function to compute chunk_func for one chunk in a worker process
+def run_chunk_func(chunk_func, chunk, args):
+    return chunk_func(worker_cows, chunk, *args)
+
+# Function to get the rows of the given cows between the starting and ending epoch time (in seconds)
+# the cows are contiguous and sorted by time in the store, so only their slices are copied
+def window_rows(cows, cow_ids, e_min, e_max):
+    parts = []
+    for cow_id in cow_ids:
+        start, end = cows.bounds(cow_id)
+        time = cows.column(cow_id, 'epoch_time')
+        first = start + np.searchsorted(time, e_min*1000, side='left')
+        last = start + np.searchsorted(time, e_max*1000, side='left')
+        parts.append(cows.df.iloc[first:last])
+    return pd.concat(parts, ignore_index=True)
+
+# Function to create the dataframes of the given cows (see initialization.create_cows), returns {tag_id: dataframe}
+# the cows are split into chunks across processes when processes > 1, each process only receives the rows of its cows
+# method and max_gap of fill_data are read here (FILL_METHOD and FILL_MAX_GAP by default) and given to the workers
+# when the cancel event is set, no more chunks are sent and the waiting ones are dropped (Cancelled is raised)
+def create_cows(cow_ids, df, e_min, e_max, area, custom=None, processes=1, method=None, max_gap=None, cancel=None):
+    check_cancel(cancel)
+    cow_ids = list(cow_ids)
+    method = init.FILL_METHOD if method is None else method
+    max_gap = init.FILL_MAX_GAP if max_gap is None else max_gap
+    if processes <= 1 or len(cow_ids) < 2:
+        return init.create_cows(cow_ids, df, e_min, e_max, area, custom, method, max_gap)
+
+    cows = st.as_store(df, 'epoch_time')
+    brn.load_barn().raster() # built once here, the forked workers inherit it instead of each building it again
+    chunks = [chunk.tolist() for chunk in np.array_split(np.array(cow_ids, dtype=object), min(len(cow_ids), processes*2))]
+    result = {}
+    executor = ProcessPoolExecutor(processes)
+    try:
+        futures = []
+        for chunk in chunks:
+            check_cancel(cancel)
+            futures.append(executor.submit(init.create_cows, chunk, window_rows(cows, chunk, e_min, e_max), e_min, e_max, area, custom, method, max_gap))
+        pending = futures
+        while pending:
+            done, pending = wait(pending, timeout=CANCEL_POLL)
+            check_cancel(cancel)
+        for future in futures:
+            result.update(future.result())
+    except Cancelled:
+        executor.shutdown(wait=False, cancel_futures=True) # the running chunks end on their own
+        raise
+    executor.shutdown()
+    return {cow_id: result[cow_id] for cow_id in cow_ids}
+
+# Function to get the (k, l) indices of the upper triangle of a matrix of n cows
+def upper_pairs(n):
+    return [(k, l) for k in range(n-1) for l in range(k+1, n)]
@@ -0,0 +1,230 @@
+######################################################################################################
+# Title: pipeline.py
+# Description:
+# The computations behind the buttons of interface.py, without any widget: loading a day, the
+# histogram of one pair of cows and the histograms of all the pairs on each side of the barn.
+# The settings are given once (Settings) and the long steps report their progress through a
+# callback and stop when asked to (cancel event), so they can run outside the Tk thread.
+######################################################################################################
+
+import os
+import json
+import datetime
+from pathlib import Path
+import initialization as init, distance as dist
+import functions as func
+import barn as brn
+import cache
+import parallel as par
+import render
+
+# Raised by the pipeline when the run has been cancelled
+Cancelled = par.Cancelled
+
+fa_file = init.fa_file
+
+# Function to read the FA file of a day and create the folders where its results are stored
+def load_day(date):
+    df = init.csv_read_bis(fa_file(date)) #Test (6 cows)
+    #df = init.csv_read(fa_file(date)) # All the cows
+
+    # Create folders if not exist to store data
+    Path("../data/" + str(date) + '/merged data').mkdir(parents=True, exist_ok=True)
+    Path("../data/" + str(date) + '/histograms/left').mkdir(parents=True, exist_ok=True)
+    Path("../data/" + str(date) + '/histograms/right').mkdir(parents=True, exist_ok=True)
+    return df
+
+# Function to get groups of cows of a day (the cows of each side, of each bed...) saved in ../data/<date>/groups.json
+# compute() is only called the first time, or when the source file (FA file by default), the data or the barn have changed
+def day_groups(date, name, df, compute, barn=brn.BARN_FILE, source=None):
+    source = fa_file(date) if source is None else source
+    stat = os.stat(source)
+    barn_file = barn.filename if isinstance(barn, brn.Barn) else barn
+    key = [os.path.basename(source), stat.st_size, stat.st_mtime_ns, len(df), os.path.abspath(barn_file)]
+
+    path = '../data/' + str(date) + '/groups.json'
+    groups = {}
+    if os.path.isfile(path):
+        with open(path) as file:
+            groups = json.load(file)
+    if name not in groups or groups[name]['key'] != key:
+        groups[name] = {'key': key, 'groups': compute()}
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(groups, file)
+        os.replace(path + '.tmp', path)
+    return groups[name]['groups']
+
+# Function to get the cows of each side of the barn of a day (see functions.side_tags), saved for the day
+def side_groups(date, df, barn=brn.BARN_FILE):
+    return day_groups(date, 'sides', df, lambda: func.side_tags(df, barn), barn)
+
+# Function to get the cows of each bed of a day (see functions.divide_cows), saved for the day
+# df holds PA data (activity_type), read from the source file
+def bed_groups(date, df, source, barn=brn.BARN_FILE):
+    return day_groups(date, 'beds', df, lambda: func.divide_cows(df, barn), barn, source)
+
+# What the computations need from the interface
+class Settings:
+
+    # date, t_min and t_max are a datetime.date and two datetime.time (minutes), custom the (x1, x2, y1, y2)
+    # of the custom area, both if the two cows have to be in the area and save to keep the merged data,
+    # memory_budget the bytes the cows of a side can use (distance.MEMORY_BUDGET by default)
+    def __init__(self, date, t_min, t_max, area="all", custom=None, both=False, save=False, nb_bar=50, memory_budget=None):
+        self.date = date
+        self.t_min = t_min
+        self.t_max = t_max
+        self.custom = None
+        self.area = area
+        if area == "custom":
+            self.custom = tuple(int(c) for c in custom)
+            self.area = "custom_" + '_'.join(str(c) for c in custom)
+        self.both = both
+        self.save = save
+        self.nb_bar = int(nb_bar)
+        self.memory_budget = dist.MEMORY_BUDGET if memory_budget is None else int(memory_budget)
+
+        # starting and ending epoch time (in seconds), the ending minute is included
+        day = datetime.datetime(date.year, date.month, date.day)
+        self.e_min = int((day + datetime.timedelta(hours=t_min.hour, minutes=t_min.minute) - datetime.datetime(1970,1,1)).total_seconds())
+        self.e_max = int((day + datetime.timedelta(hours=t_max.hour, minutes=t_max.minute + 1) - datetime.datetime(1970,1,1)).total_seconds())
+
+        self.area_check = self.area
+        if both:
+            self.area_check = self.area + "_both"
+        self.fa_file = fa_file(date)
+        self.folder = '../data/' + str(date)
+
+    # Name of the files of a pair of cows
+    def pair_name(self, cow_id1, cow_id2, area):
+        return str(cow_id1) + '_' + str(cow_id2) + '_' + self.t_min.strftime("%H%M") + '_' + self.t_max.strftime("%H%M") + '_' + area
+
+# Function to get the pairs of cows between two blocks of a side (each pair once if it is the same block)
+def block_pairs(block_1, block_2, same):
+    if same:
+        return [(block_1[k], block_1[l]) for k in range(len(block_1)) for l in range(k + 1, len(block_1))]
+    return [(cow_id1, cow_id2) for cow_id1 in block_1 for cow_id2 in block_2]
+
+class Pipeline:
+
+    # progress(done, total) is called after each step, cancel is a threading.Event checked between the steps
+    def __init__(self, settings, cows_cache=None, processes=None, progress=None, cancel=None):
+        self.settings = settings
+        self.cows_cache = cache.CowCache() if cows_cache is None else cows_cache
+        self.processes = os.cpu_count() if processes is None else processes
+        self.progress = progress
+        self.cancel = cancel
+
+    # Tell the progress and stop if the run has been cancelled
+    def report(self, done, total):
+        if self.progress is not None:
+            self.progress(done, total)
+        par.check_cancel(self.cancel)
+
+    # Create the dataframes of several cows, taken from the cache when they have already been computed
+    # the other ones are all prepared at once on a pool of processes and stored in the cache
+    def compute_cows(self, list_cow, area, data):
+        s = self.settings
+        custom = s.custom if area.startswith("custom") else None
+        return self.cows_cache.cows(s.fa_file, list_cow, data, s.e_min, s.e_max, area, custom, self.processes, self.cancel)
+
+    # Cows of a block and their cube, the dataframes are only kept when the merged data is saved
+    # (otherwise each one is freed once on the grid)
+    def compute_block(self, block, area, data):
+        cows = self.compute_cows(block, area, data)
+        cube = dist.HerdCube(cows, self.settings.e_min, self.settings.e_max, release=not self.settings.save)
+        if not self.settings.save:
+            cows = None
+        return cows, cube
+
+    # Merged data (with the distance) of a pair of cows, for the histogram
+    def pair_histogram(self, cow_id1, cow_id2):
+        s = self.settings
+        self.report(0, 2)
+
+        # Only read the two cows in the time window from the file
+        data = init.csv_read_window(s.fa_file, [cow_id1, cow_id2], s.e_min, s.e_max)
+        c1 = self.compute_cows([cow_id1], s.area, data)[cow_id1]
+        self.report(1, 2)
+
+        # if the "both" checkbox is not checked
+        area = s.area if s.both else "all"
+        c2 = self.compute_cows([cow_id2], area, data)[cow_id2]
+        self.report(2, 2)
+
+        res = dist.compare(c1,c2)
+        res = dist.compute_distance(res)
+
+        if s.save:
+            area_check = area + "_both" if s.both else area
+            res.to_csv(r''+ s.folder + '/merged data' + '/merged_' + s.pair_name(cow_id1, cow_id2, area_check) + '.csv', index = False, header=True)
+        return res
+
+    # Get histograms for cows on one side of the barn: the counts of all the pairs are saved
+    # in ../data/<date>/histograms/<side>_<HHMM>_<HHMM>_<area>.npz (bins given by edges), see render_histograms for the images
+    def compute_side(self, df, list_side, side, nb_histo, i, edges):
+        s = self.settings
+        histograms = dist.PairHistograms([(list_side[k], list_side[l]) for k in range(len(list_side)) for l in range(k + 1, len(list_side))], edges)
+
+        # The second cow is taken in the whole barn if the "both" checkbox is not checked
+        area_2 = s.area if s.both else 'all'
+
+        # Compute each cow once and put them on the same time grid, block by block to stay in the memory budget
+        # (the whole side is a single block unless it is too large): the blocks of the second cows are built
+        # once and kept, as many as fit in the budget, while the blocks of the first cows are paired with them
+        seconds = s.e_max - s.e_min
+        size = dist.cows_per_block(seconds, s.memory_budget)
+        blocks = [list_side[k:k + size] for k in range(0, len(list_side), size)]
+        kept = dist.blocks_kept(seconds, size, s.save, s.memory_budget)
+        for g in range(0, len(blocks), kept):
+            group = {b2: self.compute_block(blocks[b2], area_2, df) for b2 in range(g, min(g + kept, len(blocks)))}
+            for b1 in range(max(group) + 1):
+                if b1 in group and area_2 == s.area:
+                    cows, cube = group[b1]
+                else:
+                    cows, cube = self.compute_block(blocks[b1], s.area, df)
+                for b2 in range(max(b1, g), max(group) + 1):
+                    cows_2, cube_2 = group[b2]
+                    pairs = block_pairs(blocks[b1], blocks[b2], b1 == b2)
+                    if s.save:
+                        self.save_merged(pairs, cows, cows_2)
+                    histograms.add_cube(cube, cube_2, pairs)
+                    i += len(pairs)
+                    self.report(i, nb_histo)
+        histograms.save(self.histogram_file(side))
+        return i
+
+    # Save the merged data of pairs of cows (it keeps all the columns of both cows)
+    def save_merged(self, pairs, cows, cows_2):
+        s = self.settings
+        for cow_id1, cow_id2 in pairs:
+            res = dist.compare(cows[cow_id1],cows_2[cow_id2])
+            res = dist.compute_distance(res)
+            res.to_csv(r''+ s.folder + '/merged data/merged_' + s.pair_name(cow_id1, cow_id2, s.area_check) + '.csv', index = False, header=True)
+
+    # File of the pair histograms of a side
+    def histogram_file(self, side):
+        s = self.settings
+        return s.folder + '/histograms/' + side + '_' + s.t_min.strftime("%H%M") + '_' + s.t_max.strftime("%H%M") + '_' + s.area_check + '.npz'
+
+    # Draw the images of the pair histograms of the given sides (nb_bar bars) on a pool of processes
+    # returns the number of images and the number of images per second
+    def render_histograms(self, sides=("left", "right")):
+        jobs = [('histograms', self.histogram_file(side), self.settings.nb_bar) for side in sides]
+        return render.render_all(jobs, processes=self.processes, progress=self.report)
+
+    # Histograms of all the pairs of cows on each side of the barn (or only the given sides), returns the number of histograms
+    def all_histograms(self, df, barn=brn.BARN_FILE, sides=("left", "right")):
+        # Separate left cows and right cows (saved for the day)
+        left, right = side_groups(self.settings.date, df, barn)
+        list_cows = {"left": left, "right": right}
+
+        # determind the number of histogram to print it
+        nb_histo = sum(len(list_cows[side])*(len(list_cows[side]) - 1)//2 for side in sides)
+
+        i = 0
+        self.report(i, nb_histo)
+        edges = dist.distance_edges(brn.load_barn(barn))
+        for side in sides:
+            i = self.compute_side(df, list_cows[side], side, nb_histo, i, edges)
+        return i
@@ -0,0 +1,216 @@
+######################################################################################################
+# Title: render.py
+# Description:
+# Images of the pair histograms saved by the pipeline (.npz files, see distance.PairHistograms).
+# The fine bins are grouped into the number of bars asked for, the same bars for all the pairs of a
+# file, so a single figure (Agg, without pyplot) is drawn once and only the bar heights and the title
+# change from one pair to the next.
+# render_all() draws a list of images (pair histograms, distance between two cows, track of a cow on
+# the barn) on a pool of processes, each one keeping its figures (and the barn) from one image to the next.
+######################################################################################################
+
+import os
+import time
+import multiprocessing as mp
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.lines as mlines
+import matplotlib.patches as pat
+import distance as dist
+import functions as func
+import barn as brn
+import store as st
+
+COLUMNS = ['x', 'y', 'activity_type']
+COLORS = np.array(['k', 'b', 'y', 'r', 'g', 'm', 'c']) # colour of the activity types 0 to 5, the other ones in cyan
+ACTIVITIES = [('b', 'Standing'), ('y', 'Walking'), ('r', 'In cubicle'), ('g', 'At feed'), ('m', 'At drinker'), ('c', 'Outside'), ('k', 'Unknown')]
+
+# Function to group the bins of the histograms into nb_bar bars over the distances reached by any pair
+# returns the edges of the bars and the counts of each pair in each bar
+def group_bins(histograms, nb_bar):
+    used = np.flatnonzero(histograms.counts.sum(axis=0))
+    if len(used) == 0:
+        used = np.array([0])
+    first, last = used[0], used[-1] + 1
+    cuts = np.unique(np.linspace(first, last, nb_bar + 1).round().astype(int))
+    counts = np.add.reduceat(histograms.counts[:, first:last], cuts[:-1] - first, axis=1)
+    return histograms.edges[cuts], counts
+
+# One figure whose bars are updated for each histogram
+class HistogramRenderer:
+
+    def __init__(self, edges):
+        self.fig = Figure()
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.subplots()
+        self.bars = self.ax.bar(edges[:-1], np.zeros(len(edges) - 1), width=np.diff(edges), align='edge')
+        self.ax.grid(True)
+        self.ax.set_xlabel("Distance (in cm)")
+
+    # Set the bar heights and the title, and save the image
+    def draw(self, counts, title, path):
+        for bar, count in zip(self.bars, counts):
+            bar.set_height(count)
+        self.ax.set_ylim(0, max(counts.max(), 1)*1.05)
+        self.ax.set_title(title)
+        self.fig.savefig(path)
+
+# Function to get the images to draw for the pair histograms of a file saved by the pipeline
+# (<side>_<HHMM>_<HHMM>_<area>.npz): (counts, title, path) for each pair that has been measured,
+# the images are <cow1>_<cow2>_<HHMM>_<HHMM>_<area>.png in the folder of the side as before
+def histogram_images(path, nb_bar):
+    folder, name = os.path.split(path)
+    side, t_min, t_max, area = name[:-len('.npz')].split('_', 3)
+    histograms = dist.load_histograms(path)
+    edges, counts = group_bins(histograms, nb_bar)
+    images = []
+    for (cow_id1, cow_id2), pair_counts in zip(histograms.pairs, counts):
+        if pair_counts.sum() == 0:
+            continue
+        title = "Distance " + str(cow_id1) + " and " + str(cow_id2) + " between " + t_min[:2] + ":" + t_min[2:] + " and " + t_max[:2] + ":" + t_max[2:]
+        image = os.path.join(folder, side, str(cow_id1) + '_' + str(cow_id2) + '_' + t_min + '_' + t_max + '_' + area + '.png')
+        images.append((pair_counts, title, image))
+    return edges, images
+
+# Barn drawn once (as functions.plot_barn), the positions of one cow are added on top of it for each image
+class TrackRenderer:
+
+    def __init__(self, barn=brn.BARN_FILE):
+        barn = brn.load_barn(barn)
+        self.fig = Figure(figsize=(6,6))
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.subplots()
+        for i in range(len(barn.units)):
+            self.ax.add_patch(pat.Rectangle((barn.x[i, 0], min(barn.y[i, 0], barn.y[i, 1])), barn.x[i, 2] - barn.x[i, 0], abs(barn.y[i, 1] - barn.y[i, 0]), fill = False))
+        self.ax.set_xlim(barn.x[0, 0] - 2000, barn.x[0, 2] + 2000)
+        self.ax.set_ylim(barn.y[0, 0] - 2000, barn.y[0, 1] + 2000)
+        self.ax.legend(handles=[mlines.Line2D([], [], color=color, marker='.', markersize=15, label=label) for color, label in ACTIVITIES])
+
+    # Draw the positions of a cow coloured by activity (as functions.plot_cow_PA) and save the image
+    def draw(self, x, y, activity, title, path):
+        activity = np.asarray(activity).astype(int)
+        colors = COLORS[np.where((activity >= 0) & (activity <= 5), activity, 6)]
+        points = self.ax.scatter(x, y, s=4, c=colors)
+        self.ax.set_title(title)
+        self.fig.savefig(path)
+        points.remove()
+
+# Figure of the distance between two cows over time and its histogram (as functions.plot_distance_PA)
+class DistanceRenderer:
+
+    def __init__(self):
+        self.fig = Figure(figsize=(6,6))
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.subplots(2)
+
+    def draw(self, cows, tag_id1, tag_id2, path):
+        for ax in self.ax:
+            ax.cla()
+        func.draw_distance_PA(self.ax, cows, tag_id1, tag_id2)
+        self.fig.savefig(path)
+
+worker_cows = None
+worker_blocks = []
+worker_renderers = {}
+
+# Function run once in each process drawing images: positions (PA-data) and figures kept for all its images
+def init_worker(cows, barn):
+    global worker_cows
+    worker_cows = cows
+    worker_renderers['track'] = TrackRenderer(barn) # barn drawn once
+    worker_renderers['distance'] = DistanceRenderer()
+
+# Function run once in each worker process to attach to the shared positions
+def start_worker(spec, barn):
+    global worker_blocks
+    cows = None
+    if spec is not None:
+        cows, worker_blocks = st.attach(spec)
+    init_worker(cows, barn)
+
+# Function to draw one image in a worker
+def draw_task(task):
+    kind = task[0]
+    if kind == 'bars':
+        edges, counts, title, path = task[1:]
+        key = ('bars', edges.tobytes())
+        if key not in worker_renderers:
+            worker_renderers[key] = HistogramRenderer(edges)
+        worker_renderers[key].draw(counts, title, path)
+    elif kind == 'distance':
+        tag_id1, tag_id2, path = task[1:]
+        worker_renderers['distance'].draw(worker_cows, tag_id1, tag_id2, path)
+    elif kind == 'track':
+        tag_id, path = task[1:]
+        x = worker_cows.column(tag_id, 'x')
+        y = worker_cows.column(tag_id, 'y')
+        worker_renderers['track'].draw(x, y, worker_cows.column(tag_id, 'activity_type'), 'Cow ' + str(tag_id), path)
+    else:
+        raise ValueError("Unknown image: " + str(kind))
+
+# Function to draw a chunk of images in a worker, returns the number of images
+def run_tasks(tasks):
+    for task in tasks:
+        draw_task(task)
+    return len(tasks)
+
+# Function to split the jobs into images, the pair histograms of a file give one image per pair
+def image_tasks(jobs):
+    tasks = []
+    for job in jobs:
+        if job[0] == 'histograms':
+            edges, images = histogram_images(job[1], job[2])
+            tasks += [('bars', edges, counts, title, image) for counts, title, image in images]
+        else:
+            tasks.append(tuple(job))
+    return tasks
+
+# Function to draw images on a pool of processes, the jobs are tuples:
+#   ('histograms', file, nb_bar)         the pair histograms of a file saved by the pipeline (one image per pair)
+#   ('distance', tag_id1, tag_id2, path) distance between two cows over time and its histogram (PA-data in df)
+#   ('track', tag_id, path)              positions of a cow on the barn coloured by activity (PA-data in df)
+# the positions of df are shared with the processes, progress(done, total) is called before the first image and
+# as the images are done (when it raises, e.g. pipeline.Cancelled, the images not started are dropped)
+# returns the number of images and the number of images per second
+def render_all(jobs, df=None, barn=brn.BARN_FILE, processes=None, progress=None):
+    start = time.time()
+    tasks = image_tasks(jobs)
+    processes = os.cpu_count() if processes is None else processes
+    cows = None if df is None else st.as_store(df)
+
+    done = 0
+    if progress is not None:
+        progress(done, len(tasks))
+    if processes <= 1 or len(tasks) < 2:
+        init_worker(cows, barn)
+        for task in tasks:
+            draw_task(task)
+            done += 1
+            if progress is not None:
+                progress(done, len(tasks))
+    else:
+        spec, blocks = None, []
+        if cows is not None:
+            spec, blocks = cows.share([cows.time_col] + [c for c in COLUMNS if cows.has_column(c)])
+        try:
+            chunks = np.array_split(np.arange(len(tasks)), min(len(tasks), processes*4)) # several chunks per process to balance the load
+            # spawn: the workers get everything from start_worker, nothing is inherited from a (threaded) parent
+            with ProcessPoolExecutor(processes, mp_context=mp.get_context('spawn'), initializer=start_worker, initargs=(spec, barn)) as executor:
+                futures = [executor.submit(run_tasks, [tasks[k] for k in chunk]) for chunk in chunks]
+                try:
+                    for future in as_completed(futures):
+                        done += future.result()
+                        if progress is not None:
+                            progress(done, len(tasks))
+                except BaseException:
+                    executor.shutdown(cancel_futures=True) # only the running chunks end, before the shared memory is freed
+                    raise
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    elapsed = time.time() - start
+    return done, done/elapsed if elapsed > 0 else 0.
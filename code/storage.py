@@ -0,0 +1,160 @@
+######################################################################################################
+# Title: storage.py
+# Description:
+# Columnar binary copy of the daily csv files (FA, PA, PAA, PC).
+# Each csv is converted once into a ".cols" file next to it: a small JSON header followed by one
+# typed block per column (int32/int64/float64, text columns stored as categorical codes).
+# The blocks are reopened memory-mapped, so loading a day no longer parses the text file.
+######################################################################################################
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+MAGIC = b'COLS1\n'
+ALIGN = 64
+
+# Function to get the path of the binary file matching a csv file
+def binary_path(file):
+    root, ext = os.path.splitext(str(file))
+    return root + '.cols'
+
+# Function to check if the binary file exists and is newer than the csv file
+def is_fresh(file):
+    path = binary_path(file)
+    if not os.path.isfile(path):
+        return False
+    if not os.path.isfile(str(file)):
+        return True
+    return os.path.getmtime(path) >= os.path.getmtime(str(file))
+
+# Function to choose the smallest integer type holding all the values of a column
+def compact_int(values):
+    if len(values) == 0 or (values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max):
+        return values.astype(np.int32)
+    return values.astype(np.int64)
+
+# Function to convert a dataframe column into an array to store (and its categories for text columns)
+def encode_column(col):
+    if pd.api.types.is_integer_dtype(col.dtype):
+        return compact_int(col.to_numpy()), None
+    if pd.api.types.is_float_dtype(col.dtype) or pd.api.types.is_bool_dtype(col.dtype):
+        return col.to_numpy(), None
+    cat = col.astype('category')
+    categories = [str(c) for c in cat.cat.categories]
+    codes = cat.cat.codes.to_numpy()
+    if len(categories) < np.iinfo(np.int8).max:
+        codes = codes.astype(np.int8)
+    elif len(categories) < np.iinfo(np.int16).max:
+        codes = codes.astype(np.int16)
+    else:
+        codes = codes.astype(np.int32)
+    return codes, categories
+
+# Function to write a dataframe into a columnar binary file
+def write_table(df, path):
+    columns = []
+    blocks = []
+    offset = 0
+    for name in df.columns:
+        arr, categories = encode_column(df[name])
+        arr = np.ascontiguousarray(arr)
+        columns.append({'name': str(name), 'dtype': arr.dtype.str, 'categories': categories, 'offset': offset})
+        blocks.append(arr)
+        offset += -(-arr.nbytes // ALIGN) * ALIGN
+
+    header = json.dumps({'nrows': len(df), 'columns': columns}).encode()
+    start = data_start(header)
+
+    tmp = path + '.' + str(os.getpid()) + '.tmp' # one per process, several may convert the same file at once
+    try:
+        with open(tmp, 'wb') as file:
+            file.write(MAGIC)
+            file.write(len(header).to_bytes(8, 'little'))
+            file.write(header)
+            for c, arr in zip(columns, blocks):
+                file.seek(start + c['offset'])
+                file.write(arr.tobytes())
+        os.replace(tmp, path) # the binary file only appears once complete
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+# Function to get the position of the first column block (column offsets are relative to it)
+def data_start(header):
+    return -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+
+# Function to read the header of a columnar binary file
+def read_header(path):
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + " is not a columnar binary file")
+        size = int.from_bytes(file.read(8), 'little')
+        raw = file.read(size)
+    header = json.loads(raw)
+    header['start'] = data_start(raw)
+    return header
+
+# Function to open a columnar binary file as a dataframe whose columns are memory-mapped
+def read_table(path, names=None, nrows=0):
+    header = read_header(path)
+    n = header['nrows']
+    if nrows != 0:
+        n = min(n, nrows)
+    data = {}
+    for c in header['columns']:
+        if n == 0:
+            arr = np.zeros(0, dtype=c['dtype'])
+        else:
+            arr = np.memmap(path, dtype=np.dtype(c['dtype']), mode='c', offset=header['start'] + c['offset'], shape=(n,))
+        if c['categories'] is not None:
+            arr = pd.Categorical.from_codes(arr, categories=c['categories'])
+        data[c['name']] = arr
+    df = pd.DataFrame(data, copy=False)
+    if names is not None:
+        df.columns = names
+    return df
+
+# Function to convert a csv file into its columnar binary file
+def convert(file, names):
+    df = pd.read_csv(file, names=names, header=None)
+    write_table(df, binary_path(file))
+    return df
+
+# Function to read a csv file, using (or creating) its columnar binary file
+def read_csv(file, names, nrows=0):
+    if is_fresh(file):
+        return read_table(binary_path(file), names, nrows)
+    if nrows != 0:
+        return pd.read_csv(file, names=names, header=None, nrows=nrows)
+    df = pd.read_csv(file, names=names, header=None)
+    try:
+        write_table(df, binary_path(file))
+    except OSError: # data folder not writable, the parsed file is used as it is
+        return df
+    return read_table(binary_path(file), names)
+
+# Function to read only the rows of the given tags within [t_min, t_max[ (same unit as the time column)
+# The file is scanned chunk by chunk, so only the matching rows are ever held in memory
+def read_csv_filtered(file, names, tags, time_col, t_min, t_max, chunksize=1000000):
+    tags = np.asarray(list(tags))
+    if is_fresh(file):
+        df = read_table(binary_path(file), names)
+        tag_col = df['tag_id'].to_numpy()
+        time = df[time_col].to_numpy()
+        rows = []
+        for start in range(0, len(df), chunksize):
+            t = time[start:start + chunksize]
+            mask = np.isin(tag_col[start:start + chunksize], tags) & (t >= t_min) & (t < t_max)
+            rows.append(np.flatnonzero(mask) + start)
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        return df.iloc[rows].reset_index(drop=True)
+
+    parts = []
+    for chunk in pd.read_csv(file, names=names, header=None, chunksize=chunksize):
+        parts.append(chunk[chunk['tag_id'].isin(tags) & (chunk[time_col] >= t_min) & (chunk[time_col] < t_max)])
+    if len(parts) == 0:
+        return pd.DataFrame(columns=names)
+    return pd.concat(parts, ignore_index=True)
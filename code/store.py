@@ -0,0 +1,111 @@
+######################################################################################################
+# Title: store.py
+# Description:
+# Position data sorted once by (tag_id, time) with the offsets of each tag.
+# The rows of one cow are then a contiguous slice of the sorted data instead of a scan of the
+# whole table (df.loc[df['tag_id'] == x]) every time a cow or a pair of cows is needed.
+######################################################################################################
+
+import numpy as np
+from multiprocessing import shared_memory
+
+TIME_COLUMNS = ['time', 'start', 'epoch_time', 'rounded_time']
+
+class PositionStore:
+
+    # Sort the data by tag and time and compute the first and last row of each tag
+    def __init__(self, df, time_col=None):
+        if time_col is None:
+            time_col = next((c for c in TIME_COLUMNS if c in df.columns), None)
+        self.time_col = time_col
+
+        tag = df['tag_id'].to_numpy()
+        if time_col is not None:
+            order = np.lexsort((df[time_col].to_numpy(), tag))
+        else:
+            order = np.argsort(tag, kind='stable')
+        if not np.array_equal(order, np.arange(len(order))):
+            df = df.iloc[order]
+        self.df = df.reset_index(drop=True)
+
+        tag = self.df['tag_id'].to_numpy()
+        self.starts = np.flatnonzero(np.r_[True, tag[1:] != tag[:-1]]) if len(tag) else np.zeros(0, dtype=np.int64)
+        self.ends = np.r_[self.starts[1:], len(tag)].astype(np.int64)
+        self.tags = tag[self.starts]
+        self.index = dict(zip(self.tags.tolist(), range(len(self.tags))))
+        self.arrays = {}
+
+    # Store holding only some columns as arrays (already sorted by tag and time), without the dataframe
+    @classmethod
+    def from_arrays(cls, arrays, tags, starts, ends, time_col):
+        cows = cls.__new__(cls)
+        cows.df = None
+        cows.time_col = time_col
+        cows.tags = np.asarray(tags)
+        cows.starts = np.asarray(starts)
+        cows.ends = np.asarray(ends)
+        cows.index = dict(zip(cows.tags.tolist(), range(len(cows.tags))))
+        cows.arrays = dict(arrays)
+        return cows
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __contains__(self, tag_id):
+        return tag_id in self.index
+
+    # First and last (excluded) row of a tag, (0, 0) if the tag is not in the data
+    def bounds(self, tag_id):
+        i = self.index.get(tag_id)
+        if i is None:
+            return 0, 0
+        return self.starts[i], self.ends[i]
+
+    # Rows of one cow
+    def cow(self, tag_id):
+        start, end = self.bounds(tag_id)
+        return self.df.iloc[start:end]
+
+    # Values of one column for one cow, as a view on the sorted column (no copy)
+    def column(self, tag_id, name):
+        if name not in self.arrays:
+            self.arrays[name] = self.df[name].to_numpy()
+        start, end = self.bounds(tag_id)
+        return self.arrays[name][start:end]
+
+    # Number of rows of each tag
+    def counts(self):
+        return self.ends - self.starts
+
+    def has_column(self, name):
+        return name in self.arrays or (self.df is not None and name in self.df.columns)
+
+    # Copy some columns into shared memory blocks so that other processes can use them without a copy
+    # returns the description needed by attach() and the blocks (to close and unlink when done)
+    def share(self, columns):
+        spec = {'time_col': self.time_col, 'tags': self.tags, 'starts': self.starts, 'ends': self.ends, 'columns': {}}
+        blocks = []
+        for name in columns:
+            arr = np.ascontiguousarray(self.df[name].to_numpy() if name not in self.arrays else self.arrays[name])
+            block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[:] = arr
+            spec['columns'][name] = (block.name, arr.dtype.str, len(arr))
+            blocks.append(block)
+        return spec, blocks
+
+# Function to rebuild a store from the shared memory blocks described by PositionStore.share()
+# the blocks are returned as well, they must stay open as long as the store is used
+def attach(spec):
+    blocks = []
+    arrays = {}
+    for name, (block_name, dtype, n) in spec['columns'].items():
+        block = shared_memory.SharedMemory(name=block_name)
+        arrays[name] = np.ndarray((n,), dtype=np.dtype(dtype), buffer=block.buf)
+        blocks.append(block)
+    return PositionStore.from_arrays(arrays, spec['tags'], spec['starts'], spec['ends'], spec['time_col']), blocks
+
+# Function to get a store from a dataframe (a store is returned as it is)
+def as_store(df, time_col=None):
+    if isinstance(df, PositionStore):
+        return df
+    return PositionStore(df, time_col)
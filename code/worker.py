@@ -0,0 +1,58 @@
+######################################################################################################
+# Title: worker.py
+# Description:
+# Background thread running the jobs of the interface one after the other, so that the Tk window
+# keeps responding. The thread only posts messages (progress, result, error); the Tk thread reads
+# them with poll() and updates the widgets itself. A job can be cancelled (see pipeline.Cancelled).
+######################################################################################################
+
+import queue
+import threading
+import pipeline as pl
+
+class Worker:
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.messages = queue.Queue()
+        self.cancel = threading.Event() # set to stop the current job
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Add a job: func(*args, progress=..., cancel=...) is called in the thread, its result goes to
+    # done(result) in the Tk thread (called by poll)
+    def submit(self, name, func, args=(), done=None):
+        self.jobs.put((name, func, args, done))
+
+    # Cancel the current job and the waiting ones
+    def stop(self):
+        try:
+            while True:
+                self.jobs.get_nowait()
+        except queue.Empty:
+            pass
+        self.cancel.set()
+
+    # Run the jobs as they come
+    def run(self):
+        while True:
+            name, func, args, done = self.jobs.get()
+            self.cancel.clear()
+            progress = lambda k, n, name=name: self.messages.put(('progress', name, (k, n), None))
+            try:
+                result = func(*args, progress=progress, cancel=self.cancel)
+                self.messages.put(('done', name, result, done))
+            except pl.Cancelled:
+                self.messages.put(('cancelled', name, None, None))
+            except Exception as error:
+                self.messages.put(('error', name, error, None))
+
+    # Messages posted since the last call, as (kind, job name, value, done callback)
+    def poll(self):
+        messages = []
+        try:
+            while True:
+                messages.append(self.messages.get_nowait())
+        except queue.Empty:
+            pass
+        return messages